@@ -0,0 +1,115 @@
+import json
+import os
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Frecuencia de consulta adaptativa por thing. El intervalo parte de POLL_PERIOD, no baja
+# del periodo declarado en las propiedades TIMED (el equipo no publica más seguido),
+# se acorta cuando last_value cambia o se acerca a un umbral de alarma y se alarga
+# mientras las lecturas se mantienen estables
+POLL_PERIOD = float(os.getenv("POLL_PERIOD", 60))
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", 10))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", 300))
+ADAPT_SPEEDUP = float(os.getenv("ADAPT_SPEEDUP", 0.5))
+ADAPT_SLOWDOWN = float(os.getenv("ADAPT_SLOWDOWN", 1.5))
+# Margen, como fracción del rango [mín, máx] de la alarma, que se considera "cerca"
+ADAPT_ALARM_MARGIN = float(os.getenv("ADAPT_ALARM_MARGIN", 0.1))
+
+def parse_thresholds(raw):
+    # Parametros_Sistema 'umbrales': {"variable_name": [mínimo, máximo], ...}
+    if not raw:
+        return {}
+    try:
+        return {name: (float(limits[0]), float(limits[1])) for name, limits in json.loads(raw).items()}
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        print(f"Error: El parámetro umbrales no es válido: {e}")
+        return {}
+
+def declared_interval(properties):
+    # Periodo mínimo de las propiedades TIMED; None si alguna es ON_CHANGE
+    periods = []
+    for item in properties:
+        if item.get("update_strategy") != "TIMED":
+            return None
+        try:
+            periods.append(float(item.get("update_parameter") or 0))
+        except (TypeError, ValueError):
+            return None
+    periods = [period for period in periods if period > 0]
+    return min(periods) if periods else None
+
+def near_alarm(properties, thresholds):
+    for item in properties:
+        limits = thresholds.get(item.get("variable_name"))
+        if limits is None:
+            continue
+        try:
+            value = float(item.get("last_value"))
+        except (TypeError, ValueError):
+            continue
+        low, high = limits
+        margin = (high - low) * ADAPT_ALARM_MARGIN
+        if value <= low + margin or value >= high - margin:
+            return True
+    return False
+
+class AdaptivePolicy:
+    def __init__(self, enabled=True, tolerance=0.0):
+        self.enabled = enabled
+        # Un thing vence en el tick que le toca aunque el ciclo empiece apenas antes que el
+        # anterior; con tolerance = medio tick no se corre un tick completo en cada consulta
+        self.tolerance = tolerance
+        self._things = {}
+
+    def is_due(self, key, now=None):
+        # Sin política adaptativa el planificador ya marca el periodo: todo tick es de consulta
+        if not self.enabled:
+            return True
+        state = self._things.get(key)
+        return state is None or (now or time.monotonic()) + self.tolerance >= state["next_due"]
+
+    def observe(self, key, properties, thresholds=None, now=None):
+        now = now or time.monotonic()
+        state = self._things.setdefault(key, {"interval": POLL_PERIOD, "last_values": {}, "changes": 0.0})
+        if not self.enabled:
+            state["next_due"] = now + POLL_PERIOD
+            return POLL_PERIOD
+
+        last_values = {item.get("id"): item.get("last_value") for item in properties}
+        changed = sum(1 for property_id, value in last_values.items()
+                      if property_id in state["last_values"] and state["last_values"][property_id] != value)
+        state["last_values"] = last_values
+        # Tasa de cambio observada: media móvil de propiedades que cambiaron por consulta
+        state["changes"] = state["changes"] * 0.7 + changed * 0.3
+
+        floor = max(POLL_MIN_INTERVAL, declared_interval(properties) or 0)
+        alarm = near_alarm(properties, thresholds or {})
+        if alarm:
+            interval = floor
+        elif changed:
+            interval = state["interval"] * ADAPT_SPEEDUP
+        else:
+            interval = state["interval"] * ADAPT_SLOWDOWN
+        interval = min(max(interval, floor), POLL_MAX_INTERVAL)
+
+        state.update(interval=interval, next_due=now + interval, near_alarm=alarm)
+        return interval
+
+    def defer(self, key, seconds, now=None):
+        # Tras un fallo se espera un periodo completo en lugar de reintentar en cada tick
+        state = self._things.setdefault(key, {"interval": POLL_PERIOD, "last_values": {}, "changes": 0.0})
+        state["next_due"] = (now or time.monotonic()) + seconds
+
+    def metrics(self):
+        return {
+            "enabled": self.enabled,
+            "things": {
+                key: {"interval": state["interval"], "change_rate": state["changes"],
+                      "near_alarm": state.get("near_alarm", False),
+                      "due_in": state.get("next_due", 0) - time.monotonic()}
+                for key, state in self._things.items()
+            },
+        }
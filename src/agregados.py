@@ -0,0 +1,197 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Agregados materializados por propiedad: mínimo, máximo, suma, cantidad, primera y última
+# muestra por minuto, hora y día en Cuarto_Frio_Agregados. Cada escritura recalcula solo los
+# intervalos que tocó: los minutos desde las lecturas, las horas desde los minutos y los días
+# desde las horas. Como se recalcula en vez de sumar, repetir un lote (reintentos, spool) no
+# cuenta dos veces y una muestra tardía o corregida deja el intervalo igual que un rebuild
+LEVELS = (("minute", 60), ("hour", 3600), ("day", 86400))
+LEVEL_SECONDS = dict(LEVELS)
+
+# Posiciones dentro de la fila de data_base.insert_query
+PROPERTY_ID = 2
+VALUE_UPDATED_AT = 15
+
+schema_query = """
+    IF OBJECT_ID('dbo.Cuarto_Frio_Agregados') IS NULL
+    CREATE TABLE dbo.Cuarto_Frio_Agregados (
+        property_id NVARCHAR(64) NOT NULL,
+        bucket_seconds INT NOT NULL,
+        bucket_start DATETIME2(0) NOT NULL,
+        samples INT NOT NULL,
+        total FLOAT NOT NULL,
+        min_value FLOAT NOT NULL,
+        max_value FLOAT NOT NULL,
+        first_at DATETIME2(3) NOT NULL,
+        first_value FLOAT NOT NULL,
+        last_at DATETIME2(3) NOT NULL,
+        last_value FLOAT NOT NULL,
+        CONSTRAINT PK_Cuarto_Frio_Agregados PRIMARY KEY CLUSTERED (property_id, bucket_seconds, bucket_start)
+            WITH (DATA_COMPRESSION = PAGE)
+    )
+"""
+
+delete_query = """
+    DELETE FROM dbo.Cuarto_Frio_Agregados
+    WHERE property_id = ? AND bucket_seconds = ? AND bucket_start >= ? AND bucket_start < ?
+"""
+
+# Minutos desde las lecturas; DISTINCT descarta las filas repetidas de la tabla ancha
+minute_query = """
+    INSERT INTO dbo.Cuarto_Frio_Agregados (property_id, bucket_seconds, bucket_start, samples, total,
+                                           min_value, max_value, first_at, first_value, last_at, last_value)
+    SELECT ?, 60, bucket_start, COUNT(*), SUM(value), MIN(value), MAX(value),
+           MIN(sampled_at), MIN(first_value), MAX(sampled_at), MIN(last_value)
+    FROM (
+        SELECT bucket_start, sampled_at, value,
+               FIRST_VALUE(value) OVER (PARTITION BY bucket_start ORDER BY sampled_at) AS first_value,
+               FIRST_VALUE(value) OVER (PARTITION BY bucket_start ORDER BY sampled_at DESC) AS last_value
+        FROM (
+            SELECT DATEADD(minute, DATEDIFF(minute, '2000-01-01', value_updated_at), '2000-01-01') AS bucket_start,
+                   value_updated_at AS sampled_at, last_value AS value
+            FROM (
+                SELECT DISTINCT value_updated_at, last_value
+                FROM {source}
+                WHERE property_id = ? AND value_updated_at >= ? AND value_updated_at < ?
+                  AND last_value IS NOT NULL
+            ) lecturas
+        ) muestras
+    ) intervalos
+    GROUP BY bucket_start
+"""
+
+# Horas desde los minutos y días desde las horas
+parent_query = """
+    INSERT INTO dbo.Cuarto_Frio_Agregados (property_id, bucket_seconds, bucket_start, samples, total,
+                                           min_value, max_value, first_at, first_value, last_at, last_value)
+    SELECT ?, ?, parent_start, SUM(samples), SUM(total), MIN(min_value), MAX(max_value),
+           MIN(first_at), MIN(first_value), MAX(last_at), MIN(last_value)
+    FROM (
+        SELECT parent_start, samples, total, min_value, max_value, first_at, last_at,
+               FIRST_VALUE(first_value) OVER (PARTITION BY parent_start ORDER BY first_at) AS first_value,
+               FIRST_VALUE(last_value) OVER (PARTITION BY parent_start ORDER BY last_at DESC) AS last_value
+        FROM (
+            SELECT DATEADD({unit}, DATEDIFF({unit}, '2000-01-01', bucket_start), '2000-01-01') AS parent_start,
+                   samples, total, min_value, max_value, first_at, first_value, last_at, last_value
+            FROM dbo.Cuarto_Frio_Agregados
+            WHERE property_id = ? AND bucket_seconds = ? AND bucket_start >= ? AND bucket_start < ?
+        ) hijos
+    ) intervalos
+    GROUP BY parent_start
+"""
+
+buckets_query = """
+    SELECT bucket_start, samples, total, min_value, max_value, first_value, last_value
+    FROM dbo.Cuarto_Frio_Agregados
+    WHERE property_id = ? AND bucket_seconds = ? AND bucket_start >= ? AND bucket_start < ?
+    ORDER BY bucket_start
+"""
+
+EPOCH = datetime(1970, 1, 1)
+
+def source_table(storage_mode):
+    # En modo narrow la vista reconstruye (property_id, value_updated_at, last_value)
+    if storage_mode == "narrow":
+        return "dbo.vw_Cuarto_Frio_ArduinoUNOR4"
+    return "dbo.Cuarto_Frio_ArduinoUNOR4"
+
+def floor_to(value, seconds):
+    return EPOCH + timedelta(seconds=(value - EPOCH) // timedelta(seconds=seconds) * seconds)
+
+def ceil_to(value, seconds):
+    floor = floor_to(value, seconds)
+    return floor if floor == value else floor + timedelta(seconds=seconds)
+
+def refresh(conn, property_id, start, end, storage_mode):
+    # Recalcula los tres niveles que cubren [start, end); no confirma la transacción
+    cursor = conn.cursor()
+    try:
+        child_seconds = None
+        for unit, seconds in LEVELS:
+            # Cada nivel cubre los intervalos completos que contienen el rango del anterior
+            level_start = floor_to(start, seconds)
+            level_end = ceil_to(end, seconds)
+            cursor.execute(delete_query, property_id, seconds, level_start, level_end)
+            if child_seconds is None:
+                cursor.execute(minute_query.format(source=source_table(storage_mode)),
+                               property_id, property_id, level_start, level_end)
+            else:
+                cursor.execute(parent_query.format(unit=unit), property_id, seconds,
+                               property_id, child_seconds, level_start, level_end)
+            child_seconds = seconds
+    finally:
+        cursor.close()
+
+# Rangos que no se pudieron actualizar; se reintentan con la siguiente escritura
+_pending = {}
+_lock = threading.Lock()
+stats = {"refreshes": 0, "seconds": 0.0, "failures": 0, "pending": 0}
+
+def touched_ranges(rows):
+    # property_id -> (primera, última) fecha de muestra del lote
+    ranges = {}
+    for row in rows:
+        sampled_at = row[VALUE_UPDATED_AT]
+        if sampled_at is None:
+            continue
+        current = ranges.get(row[PROPERTY_ID])
+        if current is None:
+            ranges[row[PROPERTY_ID]] = (sampled_at, sampled_at)
+        else:
+            ranges[row[PROPERTY_ID]] = (min(current[0], sampled_at), max(current[1], sampled_at))
+    return ranges
+
+def merge_ranges(target, ranges):
+    for property_id, (first, last) in ranges.items():
+        current = target.get(property_id)
+        target[property_id] = (first, last) if current is None else (min(current[0], first), max(current[1], last))
+
+def defer(rows):
+    # Rangos que se recalcularán cuando la tabla de agregados esté disponible
+    with _lock:
+        merge_ranges(_pending, touched_ranges(rows))
+        stats["pending"] = len(_pending)
+
+def update(conn, rows, storage_mode):
+    # Se llama después de confirmar las lecturas; si falla, los rangos quedan pendientes
+    with _lock:
+        ranges = dict(_pending)
+        _pending.clear()
+    merge_ranges(ranges, touched_ranges(rows))
+    start = time.perf_counter()
+    try:
+        for property_id, (first, last) in ranges.items():
+            refresh(conn, property_id, first, last + timedelta(milliseconds=1), storage_mode)
+        conn.commit()
+    except Exception:
+        stats["failures"] += 1
+        with _lock:
+            merge_ranges(_pending, ranges)
+            stats["pending"] = len(_pending)
+        raise
+    stats["refreshes"] += len(ranges)
+    stats["seconds"] = time.perf_counter() - start
+    stats["pending"] = len(_pending)
+
+def create_schema(conn):
+    conn.cursor().execute(schema_query)
+    conn.commit()
+
+def read_buckets(conn, property_id, level, start, end, fetch_size=5000):
+    # Genera (inicio, cantidad, suma, mínimo, máximo, primero, último) en orden
+    cursor = conn.cursor()
+    cursor.arraysize = fetch_size
+    try:
+        cursor.execute(buckets_query, property_id, LEVEL_SECONDS[level], floor_to(start, LEVEL_SECONDS[level]), end)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+def metrics():
+    return dict(stats)
@@ -0,0 +1,97 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from dotenv import load_dotenv
+import data_base
+import mail
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Los errores se agrupan por huella durante ALERT_WINDOW segundos y se envía un único
+# correo resumen por ventana, con un máximo de ALERT_MAX_PER_HOUR correos por destinatario
+ALERT_WINDOW = float(os.getenv("ALERT_WINDOW", 300))
+ALERT_MAX_PER_HOUR = int(os.getenv("ALERT_MAX_PER_HOUR", 6))
+
+_pending = {}
+_lock = threading.Lock()
+_window_ready = threading.Condition(_lock)
+_worker = None
+_sent_by_recipient = {}
+_stats = {"received": 0, "digests": 0, "rate_limited": 0}
+
+def fingerprint_of(message):
+    # Los números (ids, códigos, tiempos) no distinguen un error de otro
+    return re.sub(r"\d+", "#", str(message))[:200]
+
+def notify(key, message):
+    fingerprint = f"{key}: {fingerprint_of(message)}" if key else fingerprint_of(message)
+    now = datetime.now()
+    with _lock:
+        _stats["received"] += 1
+        entry = _pending.get(fingerprint)
+        if entry is None:
+            _pending[fingerprint] = {"count": 1, "first": now, "last": now, "message": str(message)}
+        else:
+            entry["count"] += 1
+            entry["last"] = now
+            entry["message"] = str(message)
+        _window_ready.notify()
+    _start_worker()
+
+def _start_worker():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="alert-digest", daemon=True)
+            _worker.start()
+
+def _run():
+    while True:
+        with _lock:
+            while not _pending:
+                _window_ready.wait()
+        # La ventana empieza con la primera alerta pendiente
+        time.sleep(ALERT_WINDOW)
+        _flush()
+
+def _allowed(recipient):
+    sent = _sent_by_recipient.setdefault(recipient, deque())
+    now = time.monotonic()
+    while sent and now - sent[0] > 3600:
+        sent.popleft()
+    if len(sent) >= ALERT_MAX_PER_HOUR:
+        return False
+    sent.append(now)
+    return True
+
+def _flush():
+    recipient = data_base.get_user_target()
+    with _lock:
+        if not _pending:
+            return
+        if not _allowed(recipient):
+            # Se conserva lo acumulado para el siguiente resumen
+            _stats["rate_limited"] += 1
+            return
+        entries = sorted(_pending.items(), key=lambda item: item[1]["first"])
+        _pending.clear()
+        _stats["digests"] += 1
+    mail.send_mail(build_digest(entries))
+
+def build_digest(entries):
+    total = sum(entry["count"] for _, entry in entries)
+    lines = [f"Resumen de alertas: {total} errores en {len(entries)} grupos (ventana de {ALERT_WINDOW:.0f}s)"]
+    for fingerprint, entry in entries:
+        lines.append(
+            f"- {entry['count']} veces, primera {entry['first']:%Y-%m-%d %H:%M:%S}, "
+            f"última {entry['last']:%Y-%m-%d %H:%M:%S}\n  {fingerprint}\n  Último mensaje: {entry['message']}"
+        )
+    return "\n".join(lines)
+
+def metrics():
+    with _lock:
+        return dict(_stats, pending_groups=len(_pending))
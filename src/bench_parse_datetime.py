@@ -0,0 +1,72 @@
+# Micro-benchmark de parse_datetime frente a la versión anterior basada en strptime.
+# Uso: python bench_parse_datetime.py [propiedades] [lecturas]
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+import fechas
+
+def parse_datetime_strptime(date_str):
+    # Versión anterior, se conserva solo como referencia para la comparación
+    if not date_str:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+def iso(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+def build_payloads(properties, polls):
+    # created_at y updated_at fijos por propiedad, value_updated_at cambia en cada lectura
+    start = datetime(2024, 5, 10, 8, 0, 0)
+    created = [iso(start - timedelta(days=random.randint(1, 300), milliseconds=random.randint(0, 999)))
+               for _ in range(properties)]
+    payloads = []
+    for poll in range(polls):
+        now = start + timedelta(minutes=poll)
+        payloads.append([
+            {
+                "created_at": created[i],
+                "updated_at": created[i],
+                "value_updated_at": iso(now + timedelta(milliseconds=random.randint(0, 59999))),
+            }
+            for i in range(properties)
+        ])
+    return payloads
+
+def run(parse, payloads):
+    for payload in payloads:
+        for item in payload:
+            parse(item["created_at"])
+            parse(item["updated_at"])
+            parse(item["value_updated_at"])
+
+def main():
+    properties = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    polls = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    random.seed(1)
+    payloads = build_payloads(properties, polls)
+    calls = properties * polls * 3
+
+    sample = payloads[0][0]["value_updated_at"]
+    assert fechas.parse_datetime(sample) == parse_datetime_strptime(sample)
+
+    results = {}
+    for name, parse in (("strptime", parse_datetime_strptime),
+                        ("sin memo", fechas._parse_iso.__wrapped__),
+                        ("con memo", fechas.parse_datetime)):
+        # setup se ejecuta antes de cada repetición, fuera del tiempo medido: todas las
+        # repeticiones de "con memo" empiezan con la caché vacía
+        seconds = min(timeit.repeat(lambda: run(parse, payloads), setup=fechas._parse_iso.cache_clear,
+                                    number=1, repeat=3))
+        results[name] = seconds
+        print(f"{name:>10}: {seconds:.3f}s, {calls / seconds:,.0f} fechas/s")
+    for name in ("sin memo", "con memo"):
+        print(f"Aceleración {name}: {results['strptime'] / results[name]:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Cliente HTTP para Arduino Cloud: sesión con conexiones keep-alive reutilizables y
+# un executor acotado para que las peticiones bloqueantes no detengan el event loop
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", 8))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+HTTP_DEADLINE = float(os.getenv("HTTP_DEADLINE", 15))
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+executor = ThreadPoolExecutor(max_workers=HTTP_WORKERS, thread_name_prefix="cloud-http")
+
+def get(url, token):
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+    return session.get(url, headers=headers, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+async def run(function, *args, deadline=HTTP_DEADLINE):
+    # Ejecuta una llamada bloqueante en el executor con un tiempo límite total
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(executor, function, *args), deadline)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Se superó el tiempo límite de {deadline}s en la petición a la API")
+
+def shutdown():
+    executor.shutdown(wait=False, cancel_futures=True)
+    session.close()
@@ -0,0 +1,28 @@
+# Crea el índice de lectura IX_Cuarto_Frio_property_value (property_id, value_updated_at)
+# sobre Cuarto_Frio_ArduinoUNOR4 (ver data_base.read_index_query). Se ejecuta una vez, con
+# permiso ALTER sobre la tabla, antes de usar /history, /export por propiedad o ROLLUPS=1.
+# Si ya existe el índice único de DB_UPSERT no crea otro.
+# Uso: python crear_indices.py
+import argparse
+import time
+import data_base
+import db_pool
+
+def main():
+    argparse.ArgumentParser(description="Crea el índice de lectura de Cuarto_Frio_ArduinoUNOR4").parse_args()
+    if data_base.STORAGE_MODE == "narrow":
+        print("En modo narrow la clave primaria de Cuarto_Frio_Lecturas ya cubre las lecturas por propiedad")
+        return
+
+    conn = db_pool.connect()
+    # En una tabla grande el índice puede tardar más que el timeout normal de consulta
+    conn.timeout = 0
+    try:
+        start = time.perf_counter()
+        data_base.create_read_index(conn)
+        print(f"Índice de lectura disponible ({time.perf_counter() - start:.1f}s)")
+    finally:
+        db_pool.close_quietly(conn)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+import time
+import pyodbc
+from dotenv import load_dotenv
+import data_base
+import get_token
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Registro de cuentas de Arduino Cloud. La cuenta principal sale de Parametros_Sistema;
+# las adicionales, de la tabla opcional Cuentas_Arduino. Cada cuenta tiene su propia
+# caché de token, su presupuesto de peticiones por minuto y su lista de things
+ACCOUNT_RATE_LIMIT = float(os.getenv("ACCOUNT_RATE_LIMIT", 60))
+
+accounts_query = """SELECT nombre, url_token, cl_id, cl_se, url_aud, things, limite_por_minuto
+                FROM dbo.Cuentas_Arduino
+                WHERE activo = 1"""
+
+class RateLimiter:
+    # Cubeta de fichas: permite ráfagas de hasta per_minute peticiones y luego las espacia
+    def __init__(self, per_minute=ACCOUNT_RATE_LIMIT):
+        self.per_minute = per_minute
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.per_minute, self._tokens + (now - self._updated) * self.per_minute / 60)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * 60 / self.per_minute
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+class Account:
+    def __init__(self, name, tokens, things, per_minute=ACCOUNT_RATE_LIMIT):
+        self.name = name
+        self.tokens = tokens
+        self.things = things
+        self.limiter = RateLimiter(per_minute)
+
+    def credentials(self):
+        return (self.tokens.url_token, self.tokens.client_id, self.tokens.client_secret, self.tokens.audience)
+
+_accounts = {}
+_thing_index = {}
+_next_reload = 0.0
+_lock = threading.Lock()
+
+def _read_extra_accounts():
+    try:
+        with data_base.pool.connection() as conn:
+            return conn.cursor().execute(accounts_query).fetchall()
+    except pyodbc.ProgrammingError:
+        # La tabla Cuentas_Arduino es opcional
+        return []
+    except Exception as e:
+        print(f"No se pudieron cargar las cuentas de Arduino Cloud: {e}")
+        return None
+
+def _merge(name, credentials, things, per_minute, registry, tokens=None):
+    # Se conserva la cuenta existente (y su token) si las credenciales no cambiaron
+    current = _accounts.get(name)
+    if current is not None and current.credentials() == credentials:
+        current.things = things
+        if current.limiter.per_minute != per_minute:
+            current.limiter = RateLimiter(per_minute)
+        registry[name] = current
+        return
+    if current is not None and current.tokens is not tokens:
+        current.tokens.close()
+    tokens = tokens or get_token.TokenCache(*credentials, name=name)
+    registry[name] = Account(name, tokens, things, per_minute)
+
+def load_accounts():
+    # Devuelve False si no se pudieron leer las credenciales o los things de la cuenta principal
+    global _accounts, _thing_index, _next_reload
+    registry = {}
+    credentials = (data_base.get_url_token(), data_base.get_cl_id(), data_base.get_cl_se(), data_base.get_url_aud())
+    things = data_base.get_things()
+    default = get_token.default_cache()
+    # La cuenta principal comparte la caché de get_token mientras sus credenciales coincidan
+    shared = default if (default.url_token, default.client_id, default.client_secret, default.audience) == credentials else None
+    _merge("default", credentials, things, ACCOUNT_RATE_LIMIT, registry, shared)
+
+    rows = _read_extra_accounts()
+    if rows is None:
+        # Si falla la lectura se mantienen las cuentas conocidas
+        rows = []
+        registry.update({name: account for name, account in _accounts.items() if name != "default"})
+    for nombre, url_token, cl_id, cl_se, url_aud, things, limite in rows:
+        thing_ids = [thing_id.strip() for thing_id in (things or "").split(",") if thing_id.strip()]
+        _merge(str(nombre), (url_token, cl_id, cl_se, url_aud), thing_ids,
+               float(limite or ACCOUNT_RATE_LIMIT), registry)
+
+    _accounts = registry
+    _thing_index = {thing_id: account for account in registry.values() for thing_id in account.things}
+    # Sin parámetros (p. ej. la base aún no responde) se reintenta pronto, no tras PARAMS_TTL
+    loaded = bool(credentials[0] and things)
+    _next_reload = time.monotonic() + (data_base.PARAMS_TTL if loaded else data_base.PARAMS_RETRY)
+    return loaded
+
+def accounts():
+    with _lock:
+        if time.monotonic() >= _next_reload:
+            load_accounts()
+        return list(_accounts.values())
+
+def warm_up():
+    # Paso del calentamiento: falla hasta tener la cuenta principal completa
+    with _lock:
+        if not load_accounts():
+            raise RuntimeError("No se pudieron cargar las credenciales o los things de la cuenta principal")
+
+def all_things():
+    return [thing_id for account in accounts() for thing_id in account.things]
+
+def account_for(thing_id):
+    accounts()
+    return _thing_index.get(thing_id) or _accounts["default"]
+
+def metrics():
+    return {
+        account.name: {"things": len(account.things), "rate_limit_per_minute": account.limiter.per_minute,
+                       "rate_limit_wait_seconds": round(account.limiter.waited, 1)}
+        for account in _accounts.values()
+    }
@@ -1,8 +1,16 @@
 import os
+import threading
+import time
 import pyodbc
-from datetime import datetime
 from dotenv import load_dotenv
-import mail
+import agregados
+import alertas
+import db_pool
+import log_sink
+import narrow_storage
+from fechas import parse_datetime
+import spool
+import write_behind
 
 # Cargar variables de entorno
 load_dotenv()
@@ -12,175 +20,501 @@ def log_and_notify_error(message, exception=None, endpoint=None, status_code=Non
     error_detail = f"{message}: {exception}" if exception else message
     print(error_detail)
     log_to_db("ERROR", error_detail, endpoint, status_code)
-    mail.send_mail(error_detail)
-
-# Configuración de la conexión a SQL Server
-try:
-    conn = pyodbc.connect(
-        r'DRIVER={ODBC Driver 17 for SQL Server};'
-        f'SERVER={os.getenv("DATABASE_SERVER")};'
-        f'DATABASE={os.getenv("DATABASE_NAME")};'
-        f'UID={os.getenv("DATABASE_USER")};'
-        f'PWD={os.getenv("DATABASE_PASSWORD")}'
-    )
-    print("Conexión con la base de datos establecida")
-except Exception as e:
-    log_and_notify_error("Error al conectar con la base de datos", e)
+    # Los errores repetidos (p. ej. una fila mala por propiedad) se agrupan en un solo resumen
+    alertas.notify(message, error_detail)
 
-def get_value_from_db(query):
-    cursor_u = conn.cursor()
-    if cursor_u:
-        try:
-            result = cursor_u.execute(query).fetchone()
-            if result:
-                return str(result[0])
-            else:
-                print(f"Error: No se encontró ningún resultado para la consulta: {query}")
-                return None
-        except Exception as e:
-            print(f"Ocurrió un error al ejecutar la consulta: {e}")
-            return None
-        
-url_token_query = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 1 AND prm_descripcion = 'url_token'"""
+# Pool de conexiones a SQL Server compartido por el event loop y los hilos de trabajo.
+# Las conexiones se abren bajo demanda; importar el módulo no toca la base de datos
+pool = db_pool.ConnectionPool()
 
-url_aud_query = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 1 AND prm_descripcion = 'url_aud'"""
-
-cl_id_query = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 1 AND prm_descripcion = 'cl_id'"""
+def warm_up():
+    # Calentamiento desde el lifespan de la aplicación: conexión, parámetros y último
+    # valor por propiedad. Lanza la excepción para que quien llama pueda reintentar
+    try:
+        with pool.connection():
+            print("Conexión con la base de datos establecida")
+    except Exception as e:
+        log_and_notify_error("Error al conectar con la base de datos", e)
+        raise
+    pool.start_keepalive()
+    with _params_lock:
+        if not load_params():
+            raise RuntimeError("No se pudieron cargar los parámetros del sistema")
+    if not _tracker_seeded and not seed_change_tracker():
+        raise RuntimeError("No se pudo cargar la última lectura de cada propiedad")
+    ensure_unique_index()
+    ensure_read_index()
+    if readings_spool.pending():
+        readings_spool.start_replayer(replay_rows)
 
-cl_se_query  = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 1 AND prm_descripcion = 'cl_se'"""
+# Parámetros del sistema: se leen todos los de los grupos 1 y 8 en una sola consulta
+# y se mantienen en memoria durante PARAMS_TTL segundos
+PARAMS_TTL = int(os.getenv("PARAMS_TTL", 300))
+# Tras una recarga fallida se sirven los valores anteriores y se reintenta pasado este tiempo
+PARAMS_RETRY = float(os.getenv("PARAMS_RETRY", 30))
 
-url_api_query = """SELECT prm_valor
+params_query = """SELECT id_grupo, prm_descripcion, prm_valor
                 FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 1 AND prm_descripcion = 'url_api'"""
+                WHERE id_grupo IN (1, 8)"""
 
-cl_th_query = """SELECT prm_valor
-    FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 1 AND prm_descripcion = 'cl_th'"""
+_params_cache = {}
+_params_next_reload = 0.0
+# Solo lo toma quien recarga; los lectores no esperan detrás de una recarga en curso
+_params_lock = threading.Lock()
 
-user_mail_query = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 8 AND prm_descripcion = 'user_mail'"""
-
-password_mail_query = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 8 AND prm_descripcion = 'password_mail'"""
+def load_params():
+    # Un solo intento de conexión: con la base caída no se bloquea a quien pide un parámetro
+    global _params_cache, _params_next_reload
+    try:
+        with pool.connection(retries=1) as conn_u:
+            rows = conn_u.cursor().execute(params_query).fetchall()
+    except Exception as e:
+        _params_next_reload = time.monotonic() + PARAMS_RETRY
+        print(f"Ocurrió un error al cargar los parámetros del sistema, se reintentará en {PARAMS_RETRY:.0f}s: {e}")
+        return False
+    _params_cache = {(int(row[0]), str(row[1])): str(row[2]) for row in rows}
+    _params_next_reload = time.monotonic() + PARAMS_TTL
+    return True
 
-server_mail_query = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 8 AND prm_descripcion = 'domain_mail'"""
+def invalidate_params():
+    global _params_next_reload
+    _params_next_reload = 0.0
 
-port_mail_query = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 8 AND prm_descripcion = 'port'"""
+def get_param(id_grupo, descripcion, required=True):
+    if time.monotonic() >= _params_next_reload:
+        # Si no hay valores todavía se espera a la carga; si los hay, quien no consigue el
+        # lock sigue con los últimos valores conocidos mientras otro hilo recarga
+        if _params_lock.acquire(blocking=not _params_cache):
+            try:
+                if time.monotonic() >= _params_next_reload:
+                    load_params()
+            finally:
+                _params_lock.release()
+    value = _params_cache.get((id_grupo, descripcion))
+    if value is None and required:
+        print(f"Error: No se encontró el parámetro {descripcion} del grupo {id_grupo}")
+    return value
 
-target_mail_query = """SELECT prm_valor
-                FROM dbo.Parametros_Sistema
-                WHERE id_grupo = 8 AND prm_descripcion = 'mail_sis'"""
+def get_param_int(id_grupo, descripcion):
+    value = get_param(id_grupo, descripcion)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        print(f"Error: El parámetro {descripcion} no es un número entero: {value}")
+        return None
 
 def get_url_token():
-    return get_value_from_db(url_token_query)
+    return get_param(1, 'url_token')
 
 def get_url_aud():
-    return get_value_from_db(url_aud_query)
+    return get_param(1, 'url_aud')
 
 def get_cl_id():
-    return get_value_from_db(cl_id_query)
+    return get_param(1, 'cl_id')
 
 def get_cl_se():
-    return get_value_from_db(cl_se_query)
+    return get_param(1, 'cl_se')
 
 def get_url_api():
-    return get_value_from_db(url_api_query)
+    return get_param(1, 'url_api')
 
 def get_cl_th():
-    return get_value_from_db(cl_th_query)
+    return get_param(1, 'cl_th')
+
+def get_things():
+    # Lista de things a consultar: 'cl_things' (separados por coma) o, si no existe, 'cl_th'
+    raw = get_param(1, 'cl_things', required=False) or get_cl_th() or ""
+    return [thing_id.strip() for thing_id in raw.split(",") if thing_id.strip()]
+
+def get_alarm_thresholds():
+    return get_param(1, 'umbrales', required=False)
 
 def get_user_mail():
-    return get_value_from_db(user_mail_query)
+    return get_param(8, 'user_mail')
 
 def get_pass_mail():
-    return get_value_from_db(password_mail_query)
+    return get_param(8, 'password_mail')
 
 def get_port_mail():
-    return get_value_from_db(port_mail_query)
+    return get_param_int(8, 'port')
 
 def get_server_mail():
-    return get_value_from_db(server_mail_query)
+    return get_param(8, 'domain_mail')
 
 def get_user_target():
-    return get_value_from_db(target_mail_query)
+    return get_param(8, 'mail_sis')
 
 def save_data_to_db(data):
     if data is None:
         print("Data es None, no se procesará")
         return
-    if not conn:
-        print("Conexión a la base de datos no disponible")
+    if isinstance(data, dict):
+        data = [data]
+    elif not isinstance(data, list):
+        log_to_db('ERROR', 'El tipo de dato proporcionado no es válido.', endpoint='/save_data')
         return
 
-    with conn.cursor() as cursor:
-        try:
-            if isinstance(data, list):
-                for item in data:
-                    if not isinstance(item, dict):
-                        log_to_db('ERROR', f"Item no válido: {item}")
-                        continue
-                    process_and_insert(cursor, item)
-            elif isinstance(data, dict):
-                process_and_insert(cursor, data)
-            else:
-                log_to_db('ERROR', 'El tipo de dato proporcionado no es válido.', endpoint='/save_data')
+    rows = []
+    for item in data:
+        if not isinstance(item, dict):
+            log_to_db('ERROR', f"Item no válido: {item}")
+            continue
+        row = build_row(item)
+        if row is not None:
+            rows.append(row)
+
+    if not _tracker_seeded:
+        seed_change_tracker()
+    rows = filter_new_samples(rows)
+    if not rows:
+        print("Sin muestras nuevas desde la última lectura")
+        return
+
+    # Se marcan antes de encolar: si se marcaran después, un volcado fallido podría
+    # ejecutar forget_saved antes que mark_saved y la muestra quedaría marcada sin guardar.
+    # Las filas que no entran en la cola pasan al spool o se desmarcan
+    mark_saved(rows)
+    queued = writer.put_many(rows)
+    if queued < len(rows):
+        # La cola siguió llena durante WRITE_PUT_TIMEOUT: el resto va al spool local
+        spill_rows(rows[queued:])
+
+def spill_rows(rows):
+    try:
+        readings_spool.append([encode_row(row) for row in rows])
+    except OSError as e:
+        forget_saved(rows)
+        log_and_notify_error(f"No se pudieron guardar {len(rows)} lecturas en el spool", e)
+        return
+    readings_spool.start_replayer(replay_rows)
+    print(f"Buffer de escritura lleno, {len(rows)} lecturas guardadas en el spool local")
+
+def write_rows(rows):
+    # Escribe un lote del buffer write-behind con un único commit
+    if readings_spool.pending():
+        # Mientras haya lecturas sin reproducir se sigue anexando al spool para conservar el orden
+        readings_spool.append([encode_row(row) for row in rows])
+        readings_spool.start_replayer(replay_rows)
+        return
+    try:
+        with pool.connection() as conn:
+            store_rows(conn, rows)
+            conn.commit()
+        update_rollups(rows)
+    except (TimeoutError, pyodbc.OperationalError, pyodbc.InterfaceError) as e:
+        narrow_storage.reset_cache()
+        print(f"Conexión a la base de datos no disponible, {len(rows)} lecturas guardadas en el spool local: {e}")
+        readings_spool.append([encode_row(row) for row in rows])
+        readings_spool.start_replayer(replay_rows)
+    except Exception as e:
+        narrow_storage.reset_cache()
+        forget_saved(rows)
+        log_and_notify_error("Error al guardar datos en la base de datos", e)
+
+def replay_rows(records):
+    # Reproducción del spool; siempre con MERGE para que un lote repetido no duplique filas
+    rows = [decode_row(record) for record in records]
+    try:
+        with pool.connection() as conn:
+            store_rows(conn, rows, upsert=True)
             conn.commit()
-        except Exception as e:
-            log_and_notify_error("Error al guardar datos en la base de datos", e)
+    except Exception:
+        narrow_storage.reset_cache()
+        raise
+    update_rollups(rows)
 
-def process_and_insert(cursor, item):
+def update_rollups(rows):
+    # Las lecturas ya están confirmadas: un fallo aquí no las manda al spool, los
+    # intervalos quedan pendientes y se recalculan con la siguiente escritura
+    if not ROLLUPS:
+        return
     try:
-        item['created_at'] = parse_datetime(item.get('created_at'))
-        item['updated_at'] = parse_datetime(item.get('updated_at'))
-        item['value_updated_at'] = parse_datetime(item.get('value_updated_at'))
-        item['last_value'] = float(item.get('last_value', 0))
-        cursor.execute(insert_query, item['created_at'], item['href'], item['id'], item['last_value'],
-                       item['linked_to_trigger'], item['name'], item['permission'], item['persist'], item['tag'],
-                       item['thing_id'], item['thing_name'], item['type'], item['update_parameter'],
-                       item['update_strategy'], item['updated_at'], item['value_updated_at'], item['variable_name'])
+        with pool.connection() as conn:
+            if not prepare_rollups(conn):
+                agregados.defer(rows)
+                return
+            agregados.update(conn, rows, STORAGE_MODE)
     except Exception as e:
-        log_and_notify_error("Error al procesar o insertar datos", e)
+        print(f"No se pudieron actualizar los agregados, se reintentará: {e}")
+
+def prepare_rollups(conn):
+    global _rollups_ready, _rollups_retry_at
+    if _rollups_ready:
+        return True
+    if time.monotonic() < _rollups_retry_at:
+        return False
+    try:
+        if not has_read_index(conn):
+            # Sin el índice cada lote recorrería la tabla de lecturas completa desde el hilo de
+            # escritura; los intervalos quedan pendientes hasta que exista
+            _rollups_retry_at = time.monotonic() + ROLLUPS_RETRY
+            print("ROLLUPS=1 necesita el índice de lectura (python crear_indices.py o "
+                  f"reconstruir_agregados.py), se comprobará de nuevo en {ROLLUPS_RETRY:.0f}s")
+            return False
+        agregados.create_schema(conn)
+        _rollups_ready = True
+    except pyodbc.Error as e:
+        if isinstance(e, (pyodbc.OperationalError, pyodbc.InterfaceError)):
+            raise
+        conn.rollback()
+        _rollups_retry_at = time.monotonic() + ROLLUPS_RETRY
+        print(f"No se pudo crear Cuarto_Frio_Agregados, se reintentará en {ROLLUPS_RETRY:.0f}s: {e}")
+    return _rollups_ready
+
+def store_rows(conn, rows, upsert=None):
+    # STORAGE_MODE=narrow escribe en la dimensión de propiedades y la tabla de hechos angosta
+    if STORAGE_MODE != "narrow":
+        insert_rows(conn, rows, upsert)
+        return
+    written, seconds = narrow_storage.write(conn, rows)
+    last_insert_stats.update(rows=written, seconds=seconds, method="narrow",
+                             rows_per_second=written / seconds if seconds > 0 else 0.0)
+    print(f"{written} muestras guardadas en Cuarto_Frio_Lecturas en {seconds:.3f}s "
+          f"({last_insert_stats['rows_per_second']:.0f} filas/s)")
+
+# Columnas datetime de la fila: created_at, updated_at y value_updated_at
+DATETIME_COLUMNS = (0, 14, 15)
+
+def encode_row(row):
+    return [value.isoformat() if i in DATETIME_COLUMNS and value is not None else value
+            for i, value in enumerate(row)]
 
-def parse_datetime(date_str):
-    if not date_str:
+def decode_row(record):
+    return tuple(parse_datetime(value) if i in DATETIME_COLUMNS else value
+                 for i, value in enumerate(record))
+
+def build_row(item):
+    # Convierte una propiedad de Arduino Cloud en la fila de insert_query
+    try:
+        return (parse_datetime(item.get('created_at')), item['href'], item['id'],
+                float(item.get('last_value', 0)), item['linked_to_trigger'], item['name'],
+                item['permission'], item['persist'], item['tag'], item['thing_id'], item['thing_name'],
+                item['type'], item['update_parameter'], item['update_strategy'],
+                parse_datetime(item.get('updated_at')), parse_datetime(item.get('value_updated_at')),
+                item['variable_name'])
+    except Exception as e:
+        log_and_notify_error("Error al procesar o insertar datos", e)
         return None
-    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+
+# SQL Server admite como máximo 2100 parámetros y 1000 filas por sentencia
+MAX_SQL_PARAMS = 2100
+MAX_VALUES_ROWS = 1000
+INSERT_COLUMNS = 17
+
+last_insert_stats = {"rows": 0, "seconds": 0.0, "rows_per_second": 0.0, "method": None}
+
+def insert_rows(conn, rows, upsert=None):
+    if upsert is None:
+        upsert = DB_UPSERT
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    try:
         try:
-            return datetime.strptime(date_str, fmt)
-        except ValueError:
-            continue
-    return None
+            cursor.fast_executemany = True
+            cursor.executemany(values_query(1, upsert), rows)
+            method = "fast_executemany"
+        except pyodbc.Error as e:
+            if isinstance(e, (pyodbc.OperationalError, pyodbc.InterfaceError)):
+                raise
+            # Descartar lo que haya alcanzado a insertar el intento fallido
+            print(f"fast_executemany no disponible, se usan inserciones multi-fila: {e}")
+            conn.rollback()
+            insert_rows_values(cursor, rows, upsert)
+            method = "multi_values"
+    finally:
+        cursor.close()
 
-def log_to_db(log_level, message, endpoint=None, status_code=None):
-    if not conn:
-        print("No hay conexión a la base de datos para registrar logs")
+    seconds = time.perf_counter() - start
+    last_insert_stats.update(rows=len(rows), seconds=seconds, method=method,
+                             rows_per_second=len(rows) / seconds if seconds > 0 else 0.0)
+    print(f"{len(rows)} filas insertadas con {method} en {seconds:.3f}s "
+          f"({last_insert_stats['rows_per_second']:.0f} filas/s)")
+
+def insert_rows_values(cursor, rows, upsert):
+    # Sentencias con VALUES (...), (...) dentro del límite de parámetros
+    chunk_size = min(MAX_VALUES_ROWS, MAX_SQL_PARAMS // INSERT_COLUMNS)
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        cursor.execute(values_query(len(chunk), upsert), [value for row in chunk for value in row])
+
+def values_query(row_count, upsert):
+    values = ", ".join([values_placeholders] * row_count)
+    if upsert:
+        return upsert_template.format(values=values)
+    return insert_prefix + values
+
+# Seguimiento de cambios: último (value_updated_at, last_value) guardado por property_id
+# para no volver a insertar propiedades que no cambiaron entre lecturas
+_last_saved = {}
+_last_saved_lock = threading.Lock()
+_tracker_seeded = False
+
+# Con DB_UPSERT=1 se usa un índice único y MERGE para que reintentos y reinicios
+# tampoco generen filas duplicadas
+DB_UPSERT = os.getenv("DB_UPSERT", "0") == "1"
+
+# STORAGE_MODE: "wide" escribe las 17 columnas en Cuarto_Frio_ArduinoUNOR4; "narrow" usa
+# Cuarto_Frio_Propiedades + Cuarto_Frio_Lecturas (ver narrow_storage y migrar_narrow.py)
+STORAGE_MODE = os.getenv("STORAGE_MODE", "wide")
+
+# ROLLUPS=1 mantiene Cuarto_Frio_Agregados (minuto, hora y día) al guardar cada lote.
+# Requiere el índice de lectura; la tabla se crea en la primera escritura o con
+# reconstruir_agregados.py. Si falta el índice o no se puede crear la tabla se reintenta
+# cada ROLLUPS_RETRY segundos sin afectar al guardado de lecturas
+ROLLUPS = os.getenv("ROLLUPS", "0") == "1"
+ROLLUPS_RETRY = float(os.getenv("ROLLUPS_RETRY", 300))
+_rollups_ready = False
+_rollups_retry_at = 0.0
+
+latest_samples_query = """
+    SELECT property_id, value_updated_at, last_value
+    FROM (
+        SELECT property_id, value_updated_at, last_value,
+               ROW_NUMBER() OVER (PARTITION BY property_id ORDER BY value_updated_at DESC) AS rn
+        FROM Cuarto_Frio_ArduinoUNOR4
+    ) ultimas
+    WHERE rn = 1
+"""
+
+unique_index_query = """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes
+                   WHERE name = 'UX_Cuarto_Frio_property_value'
+                     AND object_id = OBJECT_ID('dbo.Cuarto_Frio_ArduinoUNOR4'))
+        CREATE UNIQUE INDEX UX_Cuarto_Frio_property_value
+            ON dbo.Cuarto_Frio_ArduinoUNOR4 (property_id, value_updated_at)
+"""
+
+# Índice de lectura (property_id, value_updated_at) que usan /history, /export por propiedad
+# y los agregados; sin él cada consulta recorre y ordena la tabla de lecturas completa. Es
+# DDL (requiere ALTER y puede tardar), así que se crea con crear_indices.py o, si se activa
+# DB_READ_INDEX=1, en un paso aparte del calentamiento. En modo narrow no hace falta: la clave
+# primaria de Cuarto_Frio_Lecturas ya está ordenada por propiedad y fecha
+DB_READ_INDEX = os.getenv("DB_READ_INDEX", "0") == "1"
+
+read_index_query = """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes
+                   WHERE name IN ('UX_Cuarto_Frio_property_value', 'IX_Cuarto_Frio_property_value')
+                     AND object_id = OBJECT_ID('dbo.Cuarto_Frio_ArduinoUNOR4'))
+        CREATE INDEX IX_Cuarto_Frio_property_value
+            ON dbo.Cuarto_Frio_ArduinoUNOR4 (property_id, value_updated_at) INCLUDE (last_value)
+"""
+
+read_index_exists_query = """
+    SELECT COUNT(*) FROM sys.indexes
+    WHERE name IN ('UX_Cuarto_Frio_property_value', 'IX_Cuarto_Frio_property_value')
+      AND object_id = OBJECT_ID('dbo.Cuarto_Frio_ArduinoUNOR4')
+"""
+
+# None mientras no se haya comprobado; se informa en /history y /metrics
+read_index_available = None
+
+def create_read_index(conn):
+    conn.cursor().execute(read_index_query)
+    conn.commit()
+
+def has_read_index(conn):
+    if STORAGE_MODE == "narrow":
+        return True
+    return conn.cursor().execute(read_index_exists_query).fetchone()[0] > 0
+
+def ensure_read_index():
+    global read_index_available
+    try:
+        with pool.connection() as conn:
+            if DB_READ_INDEX and not has_read_index(conn):
+                # Sin el timeout de consulta: en una tabla grande el índice tarda en construirse
+                conn.timeout = 0
+                try:
+                    create_read_index(conn)
+                finally:
+                    conn.timeout = db_pool.DB_QUERY_TIMEOUT
+            read_index_available = has_read_index(conn)
+    except Exception as e:
+        print(f"No se pudo comprobar o crear el índice de lectura: {e}")
         return
-    with conn.cursor() as cursor:
-        cursor.execute("""
-            INSERT INTO APILogs (log_level, message, endpoint, status_code)
-            VALUES (?, ?, ?, ?)
-        """, log_level, message, endpoint, status_code)
-        conn.commit()
-
-insert_query = """
+    if not read_index_available:
+        print("Advertencia: falta el índice IX_Cuarto_Frio_property_value; /history, /export por "
+              "propiedad y los agregados recorrerán Cuarto_Frio_ArduinoUNOR4 completa. "
+              "Se crea con python crear_indices.py")
+
+def seed_change_tracker():
+    global _tracker_seeded
+    try:
+        with pool.connection() as conn:
+            if STORAGE_MODE == "narrow":
+                if not narrow_storage.schema_exists(conn):
+                    raise RuntimeError("faltan las tablas del modo narrow, ejecute python migrar_narrow.py")
+                rows = conn.cursor().execute(narrow_storage.latest_samples_query).fetchall()
+            else:
+                rows = conn.cursor().execute(latest_samples_query).fetchall()
+    except Exception as e:
+        print(f"No se pudo cargar la última lectura de cada propiedad: {e}")
+        return False
+    with _last_saved_lock:
+        for property_id, value_updated_at, last_value in rows:
+            _last_saved[property_id] = (value_updated_at, last_value)
+        _tracker_seeded = True
+    print(f"Seguimiento de cambios iniciado con {len(rows)} propiedades")
+    return True
+
+
+def filter_new_samples(rows):
+    with _last_saved_lock:
+        return [row for row in rows if _last_saved.get(row[2]) != (row[15], row[3])]
+
+def mark_saved(rows):
+    with _last_saved_lock:
+        for row in rows:
+            _last_saved[row[2]] = (row[15], row[3])
+
+def forget_saved(rows):
+    # Tras un fallo de escritura la siguiente lectura debe volver a guardar estas muestras
+    with _last_saved_lock:
+        for row in rows:
+            if _last_saved.get(row[2]) == (row[15], row[3]):
+                del _last_saved[row[2]]
+
+writer = write_behind.WriteBehindBuffer(write_rows)
+
+readings_spool = spool.Spool("lecturas")
+
+def log_to_db(log_level, message, endpoint=None, status_code=None):
+    # Encola el registro; el hilo de log_sink lo escribe en APILogs en lote
+    if not log_sink.log(log_level, message, endpoint, status_code):
+        print(f"Log descartado por saturación: {log_level} {message}")
+
+insert_prefix = """
     INSERT INTO Cuarto_Frio_ArduinoUNOR4 (
         created_at, href, property_id, last_value, linked_to_trigger,
         name, permission, persist, tag, thing_id, thing_name,
         type, update_parameter, update_strategy, updated_at, value_updated_at, variable_name
     )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    VALUES """
+
+values_placeholders = "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+insert_query = insert_prefix + values_placeholders
+
+upsert_template = """
+    MERGE Cuarto_Frio_ArduinoUNOR4 WITH (HOLDLOCK) AS destino
+    USING (VALUES {values}) AS origen (
+        created_at, href, property_id, last_value, linked_to_trigger,
+        name, permission, persist, tag, thing_id, thing_name,
+        type, update_parameter, update_strategy, updated_at, value_updated_at, variable_name
+    )
+    ON destino.property_id = origen.property_id AND destino.value_updated_at = origen.value_updated_at
+    WHEN MATCHED AND destino.last_value <> origen.last_value THEN
+        UPDATE SET last_value = origen.last_value, updated_at = origen.updated_at
+    WHEN NOT MATCHED THEN
+        INSERT (
+            created_at, href, property_id, last_value, linked_to_trigger,
+            name, permission, persist, tag, thing_id, thing_name,
+            type, update_parameter, update_strategy, updated_at, value_updated_at, variable_name
+        )
+        VALUES (
+            origen.created_at, origen.href, origen.property_id, origen.last_value, origen.linked_to_trigger,
+            origen.name, origen.permission, origen.persist, origen.tag, origen.thing_id, origen.thing_name,
+            origen.type, origen.update_parameter, origen.update_strategy, origen.updated_at,
+            origen.value_updated_at, origen.variable_name
+        );
 """
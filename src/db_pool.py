@@ -0,0 +1,155 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import pyodbc
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración del pool de conexiones
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_QUERY_TIMEOUT = int(os.getenv("DB_QUERY_TIMEOUT", 30))
+DB_LOGIN_TIMEOUT = int(os.getenv("DB_LOGIN_TIMEOUT", 10))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", 15))
+DB_HEALTH_CHECK_IDLE = float(os.getenv("DB_HEALTH_CHECK_IDLE", 30))
+DB_KEEPALIVE_INTERVAL = float(os.getenv("DB_KEEPALIVE_INTERVAL", 120))
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", 4))
+DB_CONNECT_BACKOFF = float(os.getenv("DB_CONNECT_BACKOFF", 0.5))
+DB_CONNECT_BACKOFF_MAX = float(os.getenv("DB_CONNECT_BACKOFF_MAX", 8))
+
+def connection_string():
+    return (
+        r'DRIVER={ODBC Driver 17 for SQL Server};'
+        f'SERVER={os.getenv("DATABASE_SERVER")};'
+        f'DATABASE={os.getenv("DATABASE_NAME")};'
+        f'UID={os.getenv("DATABASE_USER")};'
+        f'PWD={os.getenv("DATABASE_PASSWORD")}'
+    )
+
+def connect(retries=DB_CONNECT_RETRIES):
+    # Abre una conexión nueva reintentando con espera exponencial
+    delay = DB_CONNECT_BACKOFF
+    for attempt in range(1, retries + 1):
+        try:
+            conn = pyodbc.connect(connection_string(), timeout=DB_LOGIN_TIMEOUT)
+            conn.timeout = DB_QUERY_TIMEOUT
+            return conn
+        except pyodbc.Error as e:
+            if attempt == retries:
+                raise
+            print(f"Intento {attempt} de conexión a la base de datos fallido: {e}. Reintentando en {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, DB_CONNECT_BACKOFF_MAX)
+
+def is_alive(conn):
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1").fetchone()
+        finally:
+            cursor.close()
+        return True
+    except pyodbc.Error:
+        return False
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except pyodbc.Error:
+        pass
+
+class ConnectionPool:
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = size
+        # Conexiones libres como (conexión, último uso); LIFO para que las
+        # conexiones sobrantes queden inactivas y las revise el keepalive
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._keepalive = None
+        self._closed = False
+
+    def acquire(self, timeout=DB_ACQUIRE_TIMEOUT, retries=DB_CONNECT_RETRIES):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No hay conexiones disponibles en el pool de la base de datos")
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return connect(retries)
+                # Verificar las conexiones que llevan tiempo sin usarse antes de entregarlas
+                if time.monotonic() - last_used < DB_HEALTH_CHECK_IDLE or is_alive(conn):
+                    return conn
+                print("Conexión inactiva descartada, no respondió a la verificación")
+                close_quietly(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        try:
+            if broken or self._closed or self._idle.qsize() >= self.size:
+                close_quietly(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout=DB_ACQUIRE_TIMEOUT, retries=DB_CONNECT_RETRIES):
+        conn = self.acquire(timeout, retries)
+        broken = False
+        try:
+            yield conn
+        except BaseException as e:
+            try:
+                conn.rollback()
+            except pyodbc.Error:
+                broken = True
+            # Los errores de comunicación dejan la conexión inutilizable
+            if isinstance(e, (pyodbc.OperationalError, pyodbc.InterfaceError)):
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def start_keepalive(self, interval=DB_KEEPALIVE_INTERVAL):
+        if self._keepalive is None:
+            self._keepalive = threading.Thread(target=self._keepalive_loop, args=(interval,),
+                                               name="db-keepalive", daemon=True)
+            self._keepalive.start()
+
+    def _keepalive_loop(self, interval):
+        while not self._closed:
+            time.sleep(interval)
+            checked = []
+            # Solo se revisan las conexiones libres; las prestadas están en uso
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if time.monotonic() - last_used < interval:
+                    checked.append((conn, last_used))
+                elif is_alive(conn):
+                    checked.append((conn, time.monotonic()))
+                else:
+                    print("Conexión inactiva cerrada por el keepalive")
+                    close_quietly(conn)
+            for item in reversed(checked):
+                self._idle.put(item)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            close_quietly(conn)
+
+    def stats(self):
+        return {"size": self.size, "idle": self._idle.qsize()}
@@ -0,0 +1,189 @@
+# Exportación de lecturas a CSV o NDJSON, con gzip opcional, para auditorías. Las filas se
+# leen con un cursor de solo avance (SQL Server las envía a medida que se piden) en bloques
+# de EXPORT_ARRAYSIZE y la salida se genera por trozos de EXPORT_CHUNK_BYTES, así la memoria
+# no depende del tamaño del rango. La usan /export y la línea de comandos:
+# python exportar.py --from 2024-01-01 --to 2024-02-01 [--property ID] [--format ndjson] [--gzip] [-o archivo]
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import zlib
+import pyodbc
+from dotenv import load_dotenv
+import agregados
+import data_base
+import db_pool
+from fechas import parse_datetime
+
+# Cargar variables de entorno
+load_dotenv()
+
+EXPORT_ARRAYSIZE = int(os.getenv("EXPORT_ARRAYSIZE", 5000))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", 256 * 1024))
+# Cada exportación usa una conexión propia fuera del pool; se limita cuántas corren a la vez
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", 2))
+FORMATS = ("csv", "ndjson")
+
+COLUMNS = ("created_at", "href", "property_id", "last_value", "linked_to_trigger",
+           "name", "permission", "persist", "tag", "thing_id", "thing_name",
+           "type", "update_parameter", "update_strategy", "updated_at", "value_updated_at", "variable_name")
+
+slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+stats = {"exports": 0, "rows": 0, "bytes": 0, "active": 0}
+
+def export_query(property_id=None):
+    # Con una propiedad se recorre el índice (property_id, value_updated_at) en orden; el
+    # rango completo se lee sin ORDER BY para no ordenar millones de filas en tempdb
+    query = (f"SELECT {', '.join(COLUMNS)} FROM {agregados.source_table(data_base.STORAGE_MODE)} "
+             "WHERE value_updated_at >= ? AND value_updated_at < ?")
+    if property_id:
+        query += " AND property_id = ? ORDER BY value_updated_at"
+    return query
+
+def iter_batches(conn, start, end, property_id=None):
+    cursor = conn.cursor()
+    cursor.arraysize = EXPORT_ARRAYSIZE
+    try:
+        params = (start, end, property_id) if property_id else (start, end)
+        cursor.execute(export_query(property_id), *params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_ARRAYSIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        try:
+            cursor.close()
+        except pyodbc.Error:
+            # La conexión ya pudo cerrarse desde Export.close
+            pass
+
+def encode_value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows([encode_value(value) for value in row] for row in rows)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def ndjson_chunks(batches):
+    parts = []
+    size = 0
+    for rows in batches:
+        for row in rows:
+            line = json.dumps(dict(zip(COLUMNS, map(encode_value, row))), ensure_ascii=False)
+            parts.append(line)
+            size += len(line) + 1
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "\n".join(parts) + "\n"
+            parts = []
+            size = 0
+    if parts:
+        yield "\n".join(parts) + "\n"
+
+def encode_chunks(chunks, compress=False):
+    # gzip incremental: cada trozo se comprime y se entrega sin esperar al final
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            stats["bytes"] += len(data)
+            yield data
+    if compressor is not None:
+        tail = compressor.flush()
+        stats["bytes"] += len(tail)
+        yield tail
+
+def counted(batches):
+    for rows in batches:
+        stats["rows"] += len(rows)
+        yield rows
+
+class Export:
+    # Conexión y cupo de una exportación. close es idempotente: lo llaman tanto el final del
+    # generador como la tarea de fondo de la respuesta, que corre aunque el cliente se
+    # desconecte antes del primer trozo y el generador nunca llegue a empezar
+    def __init__(self, conn):
+        self.conn = conn
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        stats["active"] -= 1
+        db_pool.close_quietly(self.conn)
+        slots.release()
+
+def open_export():
+    # None si ya hay EXPORT_MAX_CONCURRENT exportaciones en curso. Se conecta antes de
+    # empezar a responder para que un fallo llegue como error y no como descarga cortada
+    if not slots.acquire(blocking=False):
+        return None
+    try:
+        conn = db_pool.connect(retries=1)
+    except BaseException:
+        slots.release()
+        raise
+    # Una exportación larga no debe cortarse por el timeout normal de consulta
+    conn.timeout = 0
+    stats["exports"] += 1
+    stats["active"] += 1
+    return Export(conn)
+
+def stream(export, start, end, property_id=None, output_format="csv", compress=False):
+    # Generador de bytes; libera la exportación al terminar o cuando el cliente abandona la descarga
+    try:
+        batches = counted(iter_batches(export.conn, start, end, property_id))
+        chunks = ndjson_chunks(batches) if output_format == "ndjson" else csv_chunks(batches)
+        yield from encode_chunks(chunks, compress)
+    finally:
+        export.close()
+
+def filename(start, end, output_format, compress):
+    name = f"lecturas_{start:%Y%m%d%H%M%S}_{end:%Y%m%d%H%M%S}.{output_format}"
+    return name + ".gz" if compress else name
+
+def metrics():
+    return dict(stats)
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta lecturas a CSV o NDJSON")
+    parser.add_argument("--from", dest="start", required=True, help="inicio (UTC), YYYY-MM-DD[THH:MM:SS]")
+    parser.add_argument("--to", dest="end", required=True, help="fin exclusivo (UTC), YYYY-MM-DD[THH:MM:SS]")
+    parser.add_argument("--property", help="solo esta propiedad")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true", help="comprime la salida")
+    parser.add_argument("-o", "--output", help="archivo de salida, por defecto la salida estándar")
+    args = parser.parse_args()
+
+    bounds = [parse_datetime(value if "T" in value else value + "T00:00:00") for value in (args.start, args.end)]
+    if None in bounds:
+        raise SystemExit("--from y --to deben tener el formato YYYY-MM-DD[THH:MM:SS]")
+    export = open_export()
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for data in stream(export, bounds[0], bounds[1], args.property, args.format, args.gzip):
+            output.write(data)
+    finally:
+        export.close()
+        if args.output:
+            output.close()
+    print(f"{stats['rows']} filas exportadas, {stats['bytes']} bytes", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
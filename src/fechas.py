@@ -0,0 +1,32 @@
+import functools
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Memo de fechas ya convertidas: created_at y updated_at se repiten en cada lectura
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", 4096))
+
+def parse_datetime(date_str):
+    if not date_str:
+        return None
+    return _parse_iso(date_str)
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_iso(date_str):
+    # Formatos de Arduino Cloud: YYYY-MM-DDTHH:MM:SS[.ffffff][Z], siempre en UTC.
+    # Se valida la forma y se convierte con una sola llamada a fromisoformat
+    if (len(date_str) < 19 or date_str[4] != '-' or date_str[7] != '-' or date_str[10] != 'T'
+            or date_str[13] != ':' or date_str[16] != ':'):
+        return None
+    rest = date_str[19:]
+    if rest.endswith('Z'):
+        rest = rest[:-1]
+    if rest and not (rest[0] == '.' and 2 <= len(rest) <= 7 and rest[1:].isdigit()):
+        return None
+    try:
+        return datetime.fromisoformat(date_str).replace(tzinfo=None)
+    except ValueError:
+        return None
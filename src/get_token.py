@@ -1,32 +1,113 @@
 try:
     from dotenv import load_dotenv
     import os
+    import threading
+    import time
     import requests
     import data_base
-    import mail
-    import data_base
 except Exception as e:
     print(f"ERROR, importacion de librerias en get_token, {e}")
 
 load_dotenv()
 
-URL_TOKEN = data_base.get_url_token()
-CLIENT_ID = data_base.get_cl_id()
-CLIENT_SECRET = data_base.get_cl_se()
-URL_AUDIENCE = data_base.get_url_aud()
+# El token se renueva en segundo plano TOKEN_REFRESH_MARGIN segundos antes de expirar
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 60))
+TOKEN_RETRY_DELAY = int(os.getenv("TOKEN_RETRY_DELAY", 10))
 
-try:
-    def get_access_token():
+class TokenCache:
+    # Caché del token client_credentials de una cuenta de Arduino Cloud
+    def __init__(self, url_token, client_id, client_secret, audience, name="default"):
+        self.url_token = url_token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.audience = audience
+        self.name = name
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_timer = None
+
+    def request_token(self):
         payload = {
             "grant_type": "client_credentials",
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-            "audience": URL_AUDIENCE
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "audience": self.audience
         }
-        response = requests.post(URL_TOKEN, data=payload)
-        return response.json()["access_token"]
-except Exception as e:
-    error_message = f"Ocurrio un error con el token. Error: {e}"
-    print(error_message)
-    data_base.log_to_db(error_message, status_code=500, endpoint="token error")
-    mail(error_message)
\ No newline at end of file
+        try:
+            response = requests.post(self.url_token, data=payload, timeout=10)
+            response.raise_for_status()
+            body = response.json()
+            return body["access_token"], int(body.get("expires_in", 300))
+        except Exception as e:
+            error_message = f"Ocurrio un error con el token de la cuenta {self.name}. Error: {e}"
+            print(error_message)
+            data_base.log_to_db("ERROR", error_message, endpoint="token error", status_code=500)
+            raise
+
+    def _is_fresh(self):
+        return self._token is not None and time.monotonic() < self._expires_at - TOKEN_REFRESH_MARGIN
+
+    def _refresh_locked(self):
+        # Se llama con el lock tomado, así las renovaciones concurrentes hacen una sola petición
+        token, expires_in = self.request_token()
+        self._token = token
+        self._expires_at = time.monotonic() + expires_in
+        self._schedule_refresh(max(expires_in - TOKEN_REFRESH_MARGIN, 1))
+        return token
+
+    def _schedule_refresh(self, delay):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        self._refresh_timer = threading.Timer(delay, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self):
+        with self._lock:
+            try:
+                self._refresh_locked()
+            except Exception:
+                # Mientras el token actual siga vigente se reintenta más tarde
+                if self._token is not None and time.monotonic() < self._expires_at:
+                    self._schedule_refresh(TOKEN_RETRY_DELAY)
+
+    def get_access_token(self):
+        if self._is_fresh():
+            return self._token
+        with self._lock:
+            if self._is_fresh():
+                return self._token
+            return self._refresh_locked()
+
+    def invalidate_token(self, token):
+        # Descarta el token rechazado (401); si otro hilo ya lo renovó se conserva el nuevo
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+    def close(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def default_cache():
+    # Cuenta principal, configurada en Parametros_Sistema. Se reemplaza si cambian las
+    # credenciales, p. ej. si se creó antes de que se pudieran cargar los parámetros
+    global _default_cache
+    credentials = (data_base.get_url_token(), data_base.get_cl_id(), data_base.get_cl_se(), data_base.get_url_aud())
+    with _default_lock:
+        current = _default_cache
+        if current is None or (current.url_token, current.client_id, current.client_secret, current.audience) != credentials:
+            if current is not None:
+                current.close()
+            _default_cache = TokenCache(*credentials)
+        return _default_cache
+
+def get_access_token():
+    return default_cache().get_access_token()
+
+def invalidate_token(token):
+    default_cache().invalidate_token(token)
@@ -0,0 +1,235 @@
+import os
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import agregados
+import data_base
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Lectura del histórico de una propiedad para /history. Las filas se piden en orden de
+# (property_id, value_updated_at), que es el índice de la tabla, y se leen por bloques con
+# fetchmany. Sin points se devuelve una página cruda con cursor (paginación por clave);
+# con points se reduce el rango completo a ese número de puntos en el servidor; con rollup
+# se leen los agregados por minuto, hora o día, cuyo tamaño no depende del volumen de lecturas
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 5000))
+HISTORY_MAX_PAGE = int(os.getenv("HISTORY_MAX_PAGE", 50000))
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", 10000))
+# LTTB conserva siempre la primera y la última muestra; con menos de 3 puntos no reduce nada
+HISTORY_MIN_POINTS = 3
+HISTORY_FETCH_SIZE = int(os.getenv("HISTORY_FETCH_SIZE", 5000))
+HISTORY_DEFAULT_HOURS = float(os.getenv("HISTORY_DEFAULT_HOURS", 24))
+DOWNSAMPLE_METHODS = ("minmax", "lttb")
+ROLLUP_LEVELS = tuple(agregados.LEVEL_SECONDS) + ("auto",)
+
+wide_samples_query = """
+    SELECT {top} value_updated_at, last_value
+    FROM dbo.Cuarto_Frio_ArduinoUNOR4
+    WHERE property_id = ? AND value_updated_at {lower} ? AND value_updated_at < ?
+      AND last_value IS NOT NULL
+    ORDER BY value_updated_at
+"""
+
+narrow_samples_query = """
+    SELECT {top} l.value_updated_at, l.last_value
+    FROM dbo.Cuarto_Frio_Propiedades p
+    JOIN dbo.Cuarto_Frio_Lecturas l ON l.property_key = p.property_key
+    WHERE p.property_id = ? AND l.value_updated_at {lower} ? AND l.value_updated_at < ?
+    ORDER BY l.value_updated_at
+"""
+
+def samples_query(limit=None, exclusive=False):
+    # exclusive: la página continúa después del cursor, sin repetir su última muestra
+    query = narrow_samples_query if data_base.STORAGE_MODE == "narrow" else wide_samples_query
+    return query.format(top="TOP (?)" if limit else "", lower=">" if exclusive else ">=")
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+EPOCH = datetime(1970, 1, 1)
+
+def to_epoch(value):
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+def from_epoch(timestamp):
+    # Las fechas se guardan con milisegundos; redondear evita arrastrar el error del float
+    return EPOCH + timedelta(seconds=round(timestamp, 3))
+
+def iter_samples(conn, property_id, start, end, limit=None, exclusive=False):
+    # Genera (epoch, valor) sin cargar el resultado completo en memoria
+    cursor = conn.cursor()
+    cursor.arraysize = HISTORY_FETCH_SIZE
+    try:
+        params = (limit, property_id, start, end) if limit else (property_id, start, end)
+        cursor.execute(samples_query(limit, exclusive), *params)
+        while True:
+            rows = cursor.fetchmany(HISTORY_FETCH_SIZE)
+            if not rows:
+                break
+            for value_updated_at, last_value in rows:
+                yield to_epoch(value_updated_at), float(last_value)
+    finally:
+        cursor.close()
+
+def minmax(samples, start, end, points):
+    # Por cada intervalo de tiempo se conservan el mínimo y el máximo, así los picos
+    # siguen visibles; memoria acotada por points, el recorrido es en una sola pasada
+    buckets = max(points // 2, 1)
+    first = to_epoch(start)
+    width = (to_epoch(end) - first) / buckets or 1.0
+    low = {}
+    high = {}
+    for timestamp, value in samples:
+        bucket = min(int((timestamp - first) / width), buckets - 1)
+        current = low.get(bucket)
+        if current is None or value < current[1]:
+            low[bucket] = (timestamp, value)
+        current = high.get(bucket)
+        if current is None or value > current[1]:
+            high[bucket] = (timestamp, value)
+    timestamps = array("d")
+    values = array("d")
+    for bucket in sorted(low):
+        for timestamp, value in sorted({low[bucket], high[bucket]}):
+            timestamps.append(timestamp)
+            values.append(value)
+    return timestamps, values
+
+def lttb(timestamps, values, points):
+    # Largest-Triangle-Three-Buckets: de cada intervalo se elige el punto que forma el
+    # triángulo de mayor área con el punto elegido antes y el promedio del siguiente
+    count = len(timestamps)
+    if points >= count or points < 3:
+        return timestamps, values
+    width = (count - 2) / (points - 2)
+    out_timestamps = array("d", [timestamps[0]])
+    out_values = array("d", [values[0]])
+    chosen = 0
+    for bucket in range(points - 2):
+        first = int(bucket * width) + 1
+        last = int((bucket + 1) * width) + 1
+        next_last = min(int((bucket + 2) * width) + 1, count)
+        if bucket == points - 3:
+            next_first, next_last = count - 1, count
+        else:
+            next_first = last
+        span = next_last - next_first
+        average_x = sum(timestamps[next_first:next_last]) / span
+        average_y = sum(values[next_first:next_last]) / span
+        x0, y0 = timestamps[chosen], values[chosen]
+        best, best_area = first, -1.0
+        for index in range(first, last):
+            area = abs((x0 - average_x) * (values[index] - y0) - (x0 - timestamps[index]) * (average_y - y0))
+            if area > best_area:
+                best, best_area = index, area
+        out_timestamps.append(timestamps[best])
+        out_values.append(values[best])
+        chosen = best
+    out_timestamps.append(timestamps[-1])
+    out_values.append(values[-1])
+    return out_timestamps, out_values
+
+def read_page(property_id, start, end, limit, exclusive=False):
+    # Página cruda; el cursor de la siguiente es la última fecha devuelta
+    with data_base.pool.connection() as conn:
+        timestamps = array("d")
+        values = array("d")
+        for timestamp, value in iter_samples(conn, property_id, start, end, limit, exclusive):
+            timestamps.append(timestamp)
+            values.append(value)
+    following = None
+    if len(timestamps) == limit:
+        following = from_epoch(timestamps[-1]).isoformat()
+    return {"timestamps": timestamps.tolist(), "values": values.tolist(), "count": len(timestamps),
+            "downsampled": None, "next": following}
+
+def read_downsampled(property_id, start, end, points, method):
+    with data_base.pool.connection() as conn:
+        samples = iter_samples(conn, property_id, start, end)
+        if method == "lttb":
+            timestamps = array("d")
+            values = array("d")
+            for timestamp, value in samples:
+                timestamps.append(timestamp)
+                values.append(value)
+            count = len(timestamps)
+            if count > points:
+                timestamps, values = lttb(timestamps, values, points)
+        else:
+            # Se guardan las primeras points muestras por si el rango no necesita reducción
+            raw = []
+            count = 0
+
+            def counting():
+                nonlocal count
+                for sample in samples:
+                    count += 1
+                    if count <= points:
+                        raw.append(sample)
+                    yield sample
+
+            timestamps, values = minmax(counting(), start, end, points)
+            if count <= points:
+                timestamps = array("d", (timestamp for timestamp, _ in raw))
+                values = array("d", (value for _, value in raw))
+    downsampled = method if count > points else None
+    return {"timestamps": timestamps.tolist(), "values": values.tolist(), "count": count,
+            "downsampled": downsampled, "next": None}
+
+def rollup_level(start, end, points):
+    # El nivel más fino que entrega como máximo points intervalos
+    span = (end - start).total_seconds()
+    for level, seconds in agregados.LEVELS:
+        if span / seconds <= points:
+            return level
+    return agregados.LEVELS[-1][0]
+
+def read_rollup(property_id, start, end, level, limit):
+    timestamps = array("d")
+    averages = array("d")
+    minimums = array("d")
+    maximums = array("d")
+    samples = []
+    with data_base.pool.connection() as conn:
+        for bucket_start, count, total, min_value, max_value, _, _ in agregados.read_buckets(
+                conn, property_id, level, start, end, HISTORY_FETCH_SIZE):
+            timestamps.append(to_epoch(bucket_start))
+            averages.append(total / count)
+            minimums.append(min_value)
+            maximums.append(max_value)
+            samples.append(count)
+            if len(samples) == limit:
+                break
+    following = None
+    if len(samples) == limit:
+        # Los intervalos se piden con >=, el cursor es el inicio del siguiente
+        following = (from_epoch(timestamps[-1]) + timedelta(seconds=agregados.LEVEL_SECONDS[level])).isoformat()
+    return {"timestamps": timestamps.tolist(), "values": averages.tolist(), "min": minimums.tolist(),
+            "max": maximums.tolist(), "samples": samples, "count": len(samples), "rollup": level,
+            "downsampled": None, "next": following}
+
+def history(property_id, start=None, end=None, points=None, method="minmax", after=None, limit=None,
+            rollup=None):
+    end = end or utc_now()
+    start = start or end - timedelta(hours=HISTORY_DEFAULT_HOURS)
+    started = time.perf_counter()
+    if rollup:
+        if rollup == "auto":
+            rollup = rollup_level(start, end, min(points or HISTORY_MAX_POINTS, HISTORY_MAX_POINTS))
+        limit = min(limit or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE)
+        result = read_rollup(property_id, after if after and after >= start else start, end, rollup, limit)
+    elif points:
+        result = read_downsampled(property_id, start, end, min(points, HISTORY_MAX_POINTS), method)
+    else:
+        limit = min(limit or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE)
+        # El cursor reemplaza el inicio del rango: la consulta sigue siendo un seek del índice
+        if after is not None and after >= start:
+            result = read_page(property_id, after, end, limit, exclusive=True)
+        else:
+            result = read_page(property_id, start, end, limit)
+    # indexed=False: la tabla no tiene el índice de lectura y la consulta recorrió la tabla completa
+    result.update(property_id=property_id, start=start.isoformat(), end=end.isoformat(),
+                  query_ms=(time.perf_counter() - started) * 1000, indexed=data_base.read_index_available)
+    return result
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import socket
+import time
+import pyodbc
+from dotenv import load_dotenv
+import db_pool
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Elección de líder: con varios workers de uvicorn solo el proceso que tiene el
+# bloqueo ejecuta el poller; los demás quedan en espera y lo toman si el líder cae.
+# LEADER_MODE: "file" usa un bloqueo de archivo local (workers en la misma máquina y
+# no depende de la base de datos, así el spool sigue recibiendo lecturas si SQL Server
+# cae); "sqlserver" usa sp_getapplock para procesos repartidos en varias máquinas
+LEADER_MODE = os.getenv("LEADER_MODE", "file")
+LEADER_RESOURCE = os.getenv("LEADER_RESOURCE", "api_arduino_poller")
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", "api_arduino_poller.lock")
+LEADER_HEARTBEAT = float(os.getenv("LEADER_HEARTBEAT", 5))
+LEADER_LEASE = float(os.getenv("LEADER_LEASE", 15))
+LEADER_RETRY = float(os.getenv("LEADER_RETRY", 5))
+
+status = {"mode": LEADER_MODE, "is_leader": False, "since": None, "last_heartbeat": None, "elections": 0}
+
+class SqlServerLock:
+    # El bloqueo es de sesión: SQL Server lo libera si la conexión del líder se cierra
+    def __init__(self, resource=LEADER_RESOURCE):
+        self.resource = resource
+        self._conn = None
+
+    def acquire(self):
+        try:
+            if self._conn is None:
+                self._conn = db_pool.connect(retries=1)
+                self._conn.autocommit = True
+            result = self._conn.cursor().execute("""
+                DECLARE @resultado INT;
+                EXEC @resultado = sp_getapplock @Resource = ?, @LockMode = 'Exclusive',
+                                                @LockOwner = 'Session', @LockTimeout = 0;
+                SELECT @resultado;
+            """, self.resource).fetchone()
+            return result is not None and result[0] >= 0
+        except pyodbc.Error as e:
+            print(f"No se pudo solicitar el bloqueo de líder: {e}")
+            self._discard()
+            return False
+
+    def heartbeat(self):
+        try:
+            mode = self._conn.cursor().execute(
+                "SELECT APPLOCK_MODE('public', ?, 'Session')", self.resource).fetchone()[0]
+            return mode == "Exclusive"
+        except (pyodbc.Error, AttributeError) as e:
+            print(f"Se perdió la conexión del bloqueo de líder: {e}")
+            self._discard()
+            return False
+
+    def release(self):
+        if self._conn is None:
+            return
+        try:
+            self._conn.cursor().execute(
+                "EXEC sp_releaseapplock @Resource = ?, @LockOwner = 'Session'", self.resource)
+        except pyodbc.Error:
+            pass
+        self._discard()
+
+    def _discard(self):
+        if self._conn is not None:
+            db_pool.close_quietly(self._conn)
+            self._conn = None
+
+class FileLock:
+    # flock lo libera el sistema operativo al morir el proceso; el archivo guarda el
+    # pid y la hora del último latido para diagnóstico
+    def __init__(self, path=LEADER_LOCK_FILE):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        import fcntl
+        handle = open(self.path, "a+")
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._file = handle
+        return self.heartbeat()
+
+    def heartbeat(self):
+        if self._file is None:
+            return False
+        try:
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.write(f"{socket.gethostname()} {os.getpid()} {time.time():.0f}\n")
+            self._file.flush()
+            return True
+        except OSError as e:
+            print(f"No se pudo actualizar el archivo de líder: {e}")
+            return False
+
+    def release(self):
+        if self._file is None:
+            return
+        import fcntl
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+def create_lock():
+    if LEADER_MODE == "sqlserver":
+        return SqlServerLock()
+    return FileLock()
+
+async def run_as_leader(task_factory):
+    # Espera a ser líder, ejecuta la tarea y la cancela si se pierde el liderazgo
+    lock = create_lock()
+    while True:
+        if not await asyncio.to_thread(lock.acquire):
+            await asyncio.sleep(LEADER_RETRY)
+            continue
+
+        status.update(is_leader=True, since=time.time(), last_heartbeat=time.monotonic())
+        status["elections"] += 1
+        print(f"Proceso {os.getpid()} elegido líder, se inicia el poller")
+        task = asyncio.create_task(task_factory())
+        try:
+            while not task.done():
+                await asyncio.sleep(LEADER_HEARTBEAT)
+                try:
+                    alive = await asyncio.wait_for(asyncio.to_thread(lock.heartbeat), LEADER_LEASE)
+                except asyncio.TimeoutError:
+                    alive = False
+                if not alive:
+                    # Sin latido dentro del plazo del lease otro proceso puede tomar el bloqueo
+                    print(f"Proceso {os.getpid()} perdió el liderazgo, se detiene el poller")
+                    break
+                status["last_heartbeat"] = time.monotonic()
+        finally:
+            task.cancel()
+            status["is_leader"] = False
+            await asyncio.to_thread(lock.release)
+
+def metrics():
+    heartbeat = status["last_heartbeat"]
+    return dict(status, heartbeat_age=time.monotonic() - heartbeat if heartbeat else None, pid=os.getpid())
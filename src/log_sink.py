@@ -0,0 +1,62 @@
+import itertools
+import os
+import pyodbc
+from dotenv import load_dotenv
+import db_pool
+import write_behind
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Los registros de APILogs se encolan y un hilo propio los escribe en lotes con
+# inserciones multi-fila sobre su propia conexión, sin bloquear a quien registra
+LOG_BATCH_ROWS = int(os.getenv("LOG_BATCH_ROWS", 200))
+LOG_FLUSH_MS = int(os.getenv("LOG_FLUSH_MS", 2000))
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", 5000))
+# Por encima de esta ocupación solo se conserva 1 de cada LOG_SAMPLE_RATE registros que no son ERROR
+LOG_SAMPLE_WATERMARK = float(os.getenv("LOG_SAMPLE_WATERMARK", 0.8))
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", 10))
+
+LOG_COLUMNS = 4
+MAX_LOG_ROWS = min(1000, 2100 // LOG_COLUMNS)
+
+log_insert_prefix = """
+    INSERT INTO APILogs (log_level, message, endpoint, status_code)
+    VALUES """
+
+_conn = None
+_sample_counter = itertools.count()
+_sampled_out = 0
+
+def write_logs(rows):
+    # Solo la llama el hilo del buffer, así la conexión dedicada no se comparte
+    global _conn
+    try:
+        if _conn is None:
+            _conn = db_pool.connect(retries=1)
+        cursor = _conn.cursor()
+        for i in range(0, len(rows), MAX_LOG_ROWS):
+            chunk = rows[i:i + MAX_LOG_ROWS]
+            query = log_insert_prefix + ", ".join(["(?, ?, ?, ?)"] * len(chunk))
+            cursor.execute(query, [value for row in chunk for value in row])
+        _conn.commit()
+        cursor.close()
+    except pyodbc.Error as e:
+        print(f"No se pudieron registrar {len(rows)} logs en la base de datos: {e}")
+        if _conn is not None:
+            db_pool.close_quietly(_conn)
+            _conn = None
+
+buffer = write_behind.WriteBehindBuffer(write_logs, batch_rows=LOG_BATCH_ROWS, flush_ms=LOG_FLUSH_MS,
+                                        max_rows=LOG_QUEUE_MAX, name="log-sink")
+
+def log(log_level, message, endpoint=None, status_code=None):
+    global _sampled_out
+    if log_level != "ERROR" and buffer.fill_ratio() >= LOG_SAMPLE_WATERMARK:
+        if next(_sample_counter) % LOG_SAMPLE_RATE:
+            _sampled_out += 1
+            return False
+    return buffer.offer((log_level, message, endpoint, status_code))
+
+def metrics():
+    return dict(buffer.metrics(), sampled_out=_sampled_out)
@@ -1,44 +1,165 @@
 import smtplib
-from email.mime.text import MIMEText
 import os
+import queue
+import threading
+import time
+from email.mime.text import MIMEText
 import data_base
 
+# Los correos se encolan y un hilo de fondo los envía reutilizando una sola sesión
+# SMTP autenticada, que se cierra tras MAIL_IDLE_TIMEOUT segundos sin uso
+MAIL_QUEUE_MAX = int(os.getenv("MAIL_QUEUE_MAX", 500))
+MAIL_BATCH_MAX = int(os.getenv("MAIL_BATCH_MAX", 50))
+MAIL_IDLE_TIMEOUT = float(os.getenv("MAIL_IDLE_TIMEOUT", 60))
+MAIL_RETRY_DELAY = float(os.getenv("MAIL_RETRY_DELAY", 30))
+# Intentos por mensaje antes de descartarlo; cada uno es un resumen de alertas completo
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 5))
+
+_queue = queue.Queue(maxsize=MAIL_QUEUE_MAX)
+_worker = None
+_worker_lock = threading.Lock()
+_server = None
+_stats = {"queued": 0, "sent": 0, "failed": 0, "dropped": 0, "retried": 0, "connections": 0}
+
 def send_mail(message):
+    # Encola el mensaje y vuelve de inmediato; nunca bloquea a quien reporta el error
+    _start_worker()
+    try:
+        # En la cola van (mensaje, intentos fallidos)
+        _queue.put_nowait((message, 0))
+        _stats["queued"] += 1
+    except queue.Full:
+        _stats["dropped"] += 1
+        print(f"Cola de correo llena, mensaje descartado: {message}")
+
+def _start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="mail-sender", daemon=True)
+            _worker.start()
+
+def _settings():
+    # Obtener datos de configuración y convertirlos explícitamente al tipo correcto
+    smtp_server = str(data_base.get_server_mail())
+    smtp_port = int(data_base.get_port_mail())
+    user_mail = str(data_base.get_user_mail())
+    pass_mail = str(data_base.get_pass_mail())
+    target_mail = str(data_base.get_user_target())
+
+    # Validar datos básicos
+    if not smtp_server or not smtp_port:
+        raise ValueError("El servidor SMTP o el puerto no están configurados correctamente.")
+    return smtp_server, smtp_port, user_mail, pass_mail, target_mail
+
+def _connect(smtp_server, smtp_port, user_mail, pass_mail):
+    global _server
+    print(f"Conectando a {smtp_server}:{smtp_port}...")
+    server = smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=30)
+    server.ehlo()
+
+    # Autenticación
+    server.login(user_mail, pass_mail)
+    _server = server
+    _stats["connections"] += 1
+    return server
+
+def _session(settings):
+    # Reutiliza la sesión abierta si sigue respondiendo; si no, abre otra
+    smtp_server, smtp_port, user_mail, pass_mail, _ = settings
+    if _server is not None:
+        try:
+            if _server.noop()[0] == 250:
+                return _server
+        except (smtplib.SMTPException, OSError):
+            pass
+        _close()
+    return _connect(smtp_server, smtp_port, user_mail, pass_mail)
+
+def _close():
+    global _server
+    if _server is None:
+        return
+    try:
+        _server.quit()
+    except (smtplib.SMTPException, OSError):
+        pass
+    _server = None
+
+def _build(message, target_mail):
+    # Crear el mensaje
+    subject = "API Arduino"
+    body = f"Mensaje: {message}"
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = target_mail
+    msg['To'] = target_mail #user_mail
+    return msg
+
+def _next_batch():
     try:
-        # Obtener datos de configuración y convertirlos explícitamente al tipo correcto
-        smtp_server = str(data_base.get_server_mail())
-        smtp_port = int(data_base.get_port_mail())
-        user_mail = str(data_base.get_user_mail())
-        pass_mail = str(data_base.get_pass_mail())
-        target_mail = str(data_base.get_user_target())
-        
-        # Validar datos básicos
-        if not smtp_server or not smtp_port:
-            raise ValueError("El servidor SMTP o el puerto no están configurados correctamente.")
-        
-        print(f"Conectando a {smtp_server}:{smtp_port}...")
-        server = smtplib.SMTP_SSL(smtp_server, smtp_port)
-        server.ehlo()
-
-        # Autenticación
-        server.login(user_mail, pass_mail)
-
-        # Crear el mensaje
-        subject = "API Arduino"
-        body = f"Mensaje: {message}"
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = target_mail
-        msg['To'] = target_mail #user_mail
-
-        # Enviar el correo
-        server.sendmail(user_mail, target_mail, msg.as_string())
-        server.quit()
-        print("Correo enviado exitosamente.")
+        batch = [_queue.get(timeout=MAIL_IDLE_TIMEOUT)]
+    except queue.Empty:
+        return []
+    while len(batch) < MAIL_BATCH_MAX:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _run():
+    while True:
+        batch = _next_batch()
+        if not batch:
+            # Sin correos pendientes: se libera la sesión inactiva
+            _close()
+            continue
+        _send_batch(batch)
+
+def _send_batch(batch):
+    sent = 0
+    try:
+        settings = _settings()
+        server = _session(settings)
+        user_mail, target_mail = settings[2], settings[4]
+        for message, _ in batch:
+            msg = _build(message, target_mail).as_string()
+            try:
+                # Enviar el correo
+                server.sendmail(user_mail, target_mail, msg)
+            except smtplib.SMTPServerDisconnected:
+                # La sesión se cayó a mitad del lote: reconectar una vez y seguir
+                server = _connect(*settings[:4])
+                server.sendmail(user_mail, target_mail, msg)
+            sent += 1
+            _stats["sent"] += 1
+        print(f"{sent} correos enviados exitosamente.")
+        return
     except smtplib.SMTPException as smtp_error:
         print(f"Error con el servidor SMTP: {smtp_error}")
     except ValueError as value_error:
         print(f"Error en los datos proporcionados: {value_error}")
     except Exception as e:
         message_error = f"Error con la funcion enviar correo, {e}"
-        print(message_error)
\ No newline at end of file
+        print(message_error)
+    _close()
+    _requeue(batch[sent:])
+    time.sleep(MAIL_RETRY_DELAY)
+
+def _requeue(unsent):
+    # Los mensajes no enviados vuelven a la cola hasta agotar MAIL_MAX_ATTEMPTS
+    for message, attempts in unsent:
+        if attempts + 1 >= MAIL_MAX_ATTEMPTS:
+            _stats["failed"] += 1
+            print(f"Correo descartado tras {attempts + 1} intentos: {message}")
+            continue
+        try:
+            _queue.put_nowait((message, attempts + 1))
+            _stats["retried"] += 1
+        except queue.Full:
+            _stats["dropped"] += 1
+            print(f"Cola de correo llena, mensaje descartado: {message}")
+
+def metrics():
+    return dict(_stats, depth=_queue.qsize())
@@ -1,32 +1,91 @@
-from fastapi import FastAPI
+import time
+# Se mide cuánto tarda en importarse la aplicación (objetivo: unos milisegundos)
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import requests
 import asyncio
+import os
 import uvicorn
 import logging
 
 try:
     import data_base
-    import get_token
+    import adaptive
+    import agregados
+    import alertas
+    import cloud_client
+    import cuentas
+    import exportar
+    import fechas
+    import historial
+    import leader
+    import log_sink
     import mail
+    import recientes
+    import retry
+    import scheduler
 except ImportError as e:
     raise ImportError(f"Error al importar módulos personalizados: {e}")
 
 # Configuración básica del logger
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Estado del calentamiento en segundo plano, expuesto en /ready
+WARMUP_RETRY = float(os.getenv("WARMUP_RETRY", 10))
+warm_up_status = {"ready": False, "steps": {}, "import_seconds": None, "warm_up_seconds": None}
+
+def warm_tokens():
+    for account in cuentas.accounts():
+        account.tokens.get_access_token()
+
+async def warm_up():
+    # Cada paso se reintenta hasta completarse; la API ya atiende mientras tanto
+    start = time.perf_counter()
+    steps = (("base_de_datos", data_base.warm_up), ("cuentas", cuentas.warm_up), ("tokens", warm_tokens))
+    for name, step in steps:
+        while True:
+            try:
+                await asyncio.to_thread(step)
+                warm_up_status["steps"][name] = "ok"
+                break
+            except Exception as e:
+                warm_up_status["steps"][name] = f"error: {e}"
+                print(f"Calentamiento '{name}' fallido, se reintentará en {WARMUP_RETRY}s: {e}")
+                await asyncio.sleep(WARMUP_RETRY)
+    warm_up_status["warm_up_seconds"] = time.perf_counter() - start
+    warm_up_status["ready"] = True
+    print(f"Calentamiento completado en {warm_up_status['warm_up_seconds']:.2f}s")
+
+@asynccontextmanager
+async def lifespan(app):
+    tasks = []
+    try:
+        tasks.append(asyncio.create_task(warm_up()))
+        # Solo el proceso líder ejecuta el poller; el resto queda en espera
+        tasks.append(asyncio.create_task(leader.run_as_leader(save_data_periodically)))
+        print("Proceso periódico de guardado iniciado correctamente.")
+    except Exception as e:
+        error_message = f"Error al iniciar el proceso periódico: {str(e)}"
+        data_base.log_to_db("ERROR", error_message, endpoint="/startup", status_code=500)
+        raise
+    yield
+    for task in tasks:
+        task.cancel()
+    cloud_client.shutdown()
+    await asyncio.to_thread(data_base.writer.stop)
+    await asyncio.to_thread(log_sink.buffer.stop)
+
 app = FastAPI(
     title="API para la obtención de datos generados por el aparato ArduinoUNO R4",
     description="Se utilizó FastAPI para obtener los datos de la nube utilizando Tokens",
-    version="1.0.1"
+    version="1.0.1",
+    lifespan=lifespan
 )
 
-sent_emails = set()
-
-def send_email_once(function_name, error_message):
-    if function_name not in sent_emails:
-        mail.send_mail(error_message)
-        sent_emails.add(function_name)
-
 def get_url_base(thing_id):
     url_base = data_base.get_url_api()
     if not url_base:
@@ -35,77 +94,284 @@ def get_url_base(thing_id):
         raise ValueError(error_message)
     return url_base.format(THING_ID=thing_id)
 
-def fetch_data():
-    url = get_url_base(data_base.get_cl_th())
-    headers = {
-        "Authorization": f"Bearer {get_token.get_access_token()}",
-        "Content-Type": "application/json"
-    }
+def fetch_data(thing_id=None, account=None):
+    thing_id = thing_id or data_base.get_cl_th()
+    url = get_url_base(thing_id)
+    tokens = (account or cuentas.account_for(thing_id)).tokens
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        token = tokens.get_access_token()
+        response = cloud_client.get(url, token)
+        if response.status_code == 401:
+            # Token rechazado: se renueva y se reintenta de inmediato con el nuevo
+            logging.warning("Error 401: Token no autorizado. Renovándolo y reintentando...")
+            tokens.invalidate_token(token)
+            response = cloud_client.get(url, tokens.get_access_token())
         response.raise_for_status()
         return response.json()
     except requests.exceptions.Timeout:
-        error_message = "Timeout al conectar con la API."
+        error = retry.FetchError("Timeout al conectar con la API.", retryable=True)
     except requests.exceptions.ConnectionError:
-        error_message = "Error de conexión con la API."
+        error = retry.FetchError("Error de conexión con la API.", retryable=True)
     except requests.exceptions.HTTPError as e:
-        if response.status_code == 401:
-            error_message = "Error 401: Token no autorizado. Intentando renovarlo..."
-            logging.warning(error_message)
-            get_token.get_access_token()
-        else:
-            error_message = f"HTTPError: {e.response.status_code} {e.response.text}"
+        error = retry.from_http_error(e, f"HTTPError: {e.response.status_code} {e.response.text}")
     except Exception as e:
-        error_message = f"Error desconocido al conectar con la API: {str(e)}"
+        error = retry.FetchError(f"Error desconocido al conectar con la API: {str(e)}")
+
+    data_base.log_to_db("ERROR", str(error), endpoint="/fetch_data", status_code=error.status_code or 500)
+    alertas.notify("fetch_data", str(error))
+    raise error
+
+async def fetch_data_async(thing_id=None):
+    # Cada cuenta tiene su propio presupuesto de peticiones por minuto
+    account = await asyncio.to_thread(cuentas.account_for, thing_id)
+    await account.limiter.acquire()
+    return await cloud_client.run(fetch_data, thing_id, account)
+
+# Última lectura de cada thing publicada por el poller; /data responde desde aquí
+# mientras tenga menos de SNAPSHOT_MAX_AGE segundos
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", 90))
+
+snapshots = {}
+_refresh_tasks = {}
 
-    data_base.log_to_db("ERROR", error_message, endpoint="/fetch_data", status_code=500)
-    send_email_once("fetch_data", error_message)
-    raise RuntimeError(error_message)
+def publish_snapshot(thing_id, data):
+    snapshots[thing_id] = {"data": data, "fetched_at": time.monotonic()}
+
+def snapshot_age(thing_id):
+    snapshot = snapshots.get(thing_id)
+    if snapshot is None:
+        return None
+    return time.monotonic() - snapshot["fetched_at"]
+
+async def _refresh(thing_id):
+    data = await fetch_data_async(thing_id)
+    publish_snapshot(thing_id, data)
+    return data
+
+async def refresh_snapshot(thing_id):
+    # Las peticiones concurrentes de un mismo thing comparten una sola consulta a la API
+    task = _refresh_tasks.get(thing_id)
+    if task is None or task.done():
+        task = _refresh_tasks[thing_id] = asyncio.ensure_future(_refresh(thing_id))
+    return await asyncio.shield(task)
+
+def set_age_headers(response, thing_id, stale=False):
+    age = snapshot_age(thing_id) or 0.0
+    response.headers["Age"] = str(int(age))
+    response.headers["X-Data-Age"] = f"{age:.1f}"
+    response.headers["X-Data-Stale"] = "1" if stale else "0"
 
 @app.get("/data", description="Endpoint principal, obtiene la información de Arduino")
-async def get_data():
-    MAX_RETRIES = 3
-    retry_count = 0
-    while retry_count < MAX_RETRIES:
-        try:
-            data = fetch_data()
-            if not data:
-                return {"message": "No se encontraron datos."}
-            return data
-        except Exception as e:
-            retry_count += 1
-            if retry_count < MAX_RETRIES:
-                print(f"Intento {retry_count} fallido: {str(e)} Reintentando")
-                await asyncio.sleep(2)
-            else:
-                error_message = f"Error tras {MAX_RETRIES} intentos realizados: {retry_count}"
-                print(error_message)
-                return {"error": f"Falló la obtención de datos: {str(e)}"}
+async def get_data(response: Response, thing_id: str = None):
+    if thing_id is None:
+        things = await asyncio.to_thread(data_base.get_things)
+        thing_id = things[0] if things else None
+    # Solo things configurados: el id va a la URL de la API con el token de su cuenta y cada
+    # valor distinto deja una entrada en snapshots
+    if thing_id not in await asyncio.to_thread(cuentas.all_things):
+        response.status_code = 404
+        return {"error": f"Thing desconocido: {thing_id}"}
+    age = snapshot_age(thing_id)
+    if age is not None and age <= SNAPSHOT_MAX_AGE:
+        set_age_headers(response, thing_id)
+        data = snapshots[thing_id]["data"]
+        return data if data else {"message": "No se encontraron datos."}
 
-async def save_data_periodically():
-    while True:
-        try:
-            data = fetch_data()
-            if data:
-                await asyncio.to_thread(data_base.save_data_to_db, data)
-                print("informacion guardada " , data)
-        except Exception as e:
-            error_message = f"Error al guardar datos periódicos: {str(e)}"
-            print(error_message)
-            data_base.log_to_db("ERROR", error_message, endpoint="/save_periodic", status_code=500)
-            send_email_once("save_data_periodically", error_message)
-        await asyncio.sleep(60)
-
-@app.on_event("startup")
-async def startup_event():
     try:
-        asyncio.create_task(save_data_periodically())
-        print("Proceso periódico de guardado iniciado correctamente.")
+        # Reintentos con espera exponencial, acotados por DATA_DEADLINE segundos en total
+        data = await retry.call_with_retry(lambda: refresh_snapshot(thing_id), retry.DATA_DEADLINE,
+                                           name=f"/data {thing_id}")
+        set_age_headers(response, thing_id)
+        if not data:
+            return {"message": "No se encontraron datos."}
+        return data
     except Exception as e:
-        error_message = f"Error al iniciar el proceso periódico: {str(e)}"
-        data_base.log_to_db("ERROR", error_message, endpoint="/startup", status_code=500)
-        raise
+        print(f"Falló la obtención de datos de {thing_id}: {e}")
+        if thing_id in snapshots and snapshots[thing_id]["data"]:
+            # Mejor una lectura antigua marcada como tal que ninguna
+            set_age_headers(response, thing_id, stale=True)
+            return snapshots[thing_id]["data"]
+        return {"error": f"Falló la obtención de datos: {str(e)}"}
+
+@app.get("/recent", description="Lecturas recientes en memoria por propiedad o thing")
+async def get_recent(response: Response, property_id: str = None, thing_id: str = None, minutes: float = 60,
+                     since: str = None, until: str = None):
+    # property_id admite varios valores separados por coma; sin filtros se devuelven todas.
+    # Solo el proceso líder ejecuta el poller que llena los búferes; con varios workers los
+    # demás responden 503 para que el balanceador o el cliente reintenten en otro
+    if not leader.status["is_leader"]:
+        response.status_code = 503
+        return {"error": "Este proceso no ejecuta el poller y no tiene lecturas recientes", "leader": False}
+    start = time.perf_counter()
+    if property_id:
+        property_ids = [value.strip() for value in property_id.split(",") if value.strip()]
+    elif thing_id:
+        property_ids = sorted(recientes.thing_properties.get(thing_id, ()))
+    else:
+        property_ids = list(recientes.buffers)
+    since_dt = fechas.parse_datetime(since)
+    until_dt = fechas.parse_datetime(until)
+    if (since and since_dt is None) or (until and until_dt is None):
+        return {"error": "since y until deben tener el formato YYYY-MM-DDTHH:MM:SS en UTC"}
+    lower = recientes.to_epoch(since_dt) if since_dt else time.time() - minutes * 60
+    upper = recientes.to_epoch(until_dt) if until_dt else None
+    samples = recientes.query(property_ids, lower, upper)
+    return {
+        "properties": {
+            key: {"timestamps": timestamps, "values": values}
+            for key, (timestamps, values) in samples.items()
+        },
+        "query_ms": (time.perf_counter() - start) * 1000,
+        "leader": True,
+    }
+
+@app.get("/history", description="Histórico de una propiedad, paginado o reducido a N puntos")
+async def get_history(property: str, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"),
+                      points: int = None, method: str = "minmax", after: str = None, limit: int = None,
+                      rollup: str = None):
+    # Sin points: páginas de limit muestras; la siguiente se pide con after=<next>.
+    # rollup=minute|hour|day|auto lee los agregados precalculados en lugar de las lecturas
+    bounds = [fechas.parse_datetime(value) for value in (start, end, after)]
+    if any(value and parsed is None for value, parsed in zip((start, end, after), bounds)):
+        return JSONResponse({"error": "from, to y after deben tener el formato YYYY-MM-DDTHH:MM:SS en UTC"}, 400)
+    if method not in historial.DOWNSAMPLE_METHODS:
+        return JSONResponse({"error": f"method debe ser uno de {', '.join(historial.DOWNSAMPLE_METHODS)}"}, 400)
+    if rollup and rollup not in historial.ROLLUP_LEVELS:
+        return JSONResponse({"error": f"rollup debe ser uno de {', '.join(historial.ROLLUP_LEVELS)}"}, 400)
+    if points is not None and points < historial.HISTORY_MIN_POINTS:
+        return JSONResponse({"error": f"points debe ser al menos {historial.HISTORY_MIN_POINTS}"}, 400)
+    if limit is not None and limit < 1:
+        return JSONResponse({"error": "limit debe ser al menos 1"}, 400)
+    try:
+        return await asyncio.to_thread(historial.history, property, bounds[0], bounds[1], points, method,
+                                       bounds[2], limit, rollup)
+    except Exception as e:
+        error_message = f"Error al leer el histórico de {property}: {str(e)}"
+        data_base.log_to_db("ERROR", error_message, endpoint="/history", status_code=500)
+        return {"error": error_message}
+
+@app.get("/export", description="Descarga las lecturas de un rango en CSV o NDJSON, con gzip opcional")
+async def get_export(start: str = Query(..., alias="from"), end: str = Query(..., alias="to"),
+                     property: str = None, format: str = "csv", gzip: bool = False):
+    bounds = [fechas.parse_datetime(value if "T" in value else value + "T00:00:00") for value in (start, end)]
+    if None in bounds:
+        return JSONResponse({"error": "from y to deben tener el formato YYYY-MM-DD[THH:MM:SS] en UTC"}, 400)
+    if format not in exportar.FORMATS:
+        return JSONResponse({"error": f"format debe ser uno de {', '.join(exportar.FORMATS)}"}, 400)
+    try:
+        export = await asyncio.to_thread(exportar.open_export)
+    except Exception as e:
+        error_message = f"Error al iniciar la exportación: {str(e)}"
+        data_base.log_to_db("ERROR", error_message, endpoint="/export", status_code=500)
+        return JSONResponse({"error": error_message}, 500)
+    if export is None:
+        return JSONResponse({"error": "Hay demasiadas exportaciones en curso, reintente más tarde"}, 429)
+    # StreamingResponse recorre el generador en el threadpool, trozo a trozo; la tarea de
+    # fondo libera la conexión y el cupo aunque el cliente se vaya antes del primer trozo
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    name = exportar.filename(bounds[0], bounds[1], format, gzip)
+    return StreamingResponse(exportar.stream(export, bounds[0], bounds[1], property, format, gzip),
+                             media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'},
+                             background=BackgroundTask(export.close))
+
+# Con POLL_ADAPTIVE=1 el planificador late cada POLL_TICK segundos y cada thing se
+# consulta solo cuando vence su intervalo adaptativo; si no, cada POLL_PERIOD segundos
+POLL_ADAPTIVE = os.getenv("POLL_ADAPTIVE", "1") == "1"
+POLL_TICK = float(os.getenv("POLL_TICK", 5))
+# Máximo de things consultados a la vez dentro de un ciclo
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", cloud_client.HTTP_WORKERS))
+
+poll_scheduler = scheduler.FixedRateScheduler("poller", period=POLL_TICK if POLL_ADAPTIVE else scheduler.POLL_PERIOD)
+poll_policy = adaptive.AdaptivePolicy(enabled=POLL_ADAPTIVE, tolerance=POLL_TICK / 2)
+poll_batch_stats = {}
+
+async def poll_thing(thing_id, thresholds, started=None):
+    try:
+        data = await retry.call_with_retry(lambda: refresh_snapshot(thing_id), retry.POLL_DEADLINE,
+                                           name=f"consulta de {thing_id}")
+        properties = (data if isinstance(data, list) else [data]) if data else []
+        if data:
+            await asyncio.to_thread(data_base.save_data_to_db, data)
+            recientes.add_properties(properties)
+            print(f"informacion guardada de {thing_id}: {len(properties)} propiedades")
+        # También sin propiedades, para no volver a consultar el thing en cada tick. El
+        # intervalo se cuenta desde el inicio del ciclo, no desde que terminó el guardado
+        interval = poll_policy.observe(thing_id, properties, thresholds, now=started)
+        print(f"Próxima consulta de {thing_id} en {interval:.0f}s")
+        return True
+    except Exception as e:
+        error_message = f"Error al guardar datos periódicos de {thing_id}: {str(e)}"
+        print(error_message)
+        data_base.log_to_db("ERROR", error_message, endpoint="/save_periodic", status_code=500)
+        alertas.notify("save_data_periodically", error_message)
+        poll_policy.defer(thing_id, scheduler.POLL_PERIOD, now=started)
+        return False
+
+async def poll_cycle():
+    # El mismo instante decide qué things vencen y desde dónde se cuenta su próximo intervalo
+    start = time.monotonic()
+    things = await asyncio.to_thread(cuentas.all_things)
+    due = [thing_id for thing_id in things if poll_policy.is_due(thing_id, now=start)]
+    if not due:
+        return
+    thresholds = adaptive.parse_thresholds(await asyncio.to_thread(data_base.get_alarm_thresholds))
+    semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+    durations = []
+
+    async def limited(thing_id):
+        async with semaphore:
+            ok = await poll_thing(thing_id, thresholds, start)
+        durations.append(time.monotonic() - start)
+        return ok
+
+    results = await asyncio.gather(*(limited(thing_id) for thing_id in due))
+    durations.sort()
+    # Un thing llega a tiempo si termina dentro del periodo de consulta
+    poll_batch_stats.update(
+        things=len(due),
+        completed=sum(results),
+        failed=len(results) - sum(results),
+        on_time=sum(1 for duration in durations if duration <= scheduler.POLL_PERIOD),
+        batch_seconds=durations[-1],
+        p50_seconds=durations[len(durations) // 2],
+        p95_seconds=durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+    )
+    print(f"Lote de {len(due)} things: {poll_batch_stats['completed']} completados, "
+          f"{poll_batch_stats['on_time']} a tiempo en {durations[-1]:.1f}s")
+
+async def save_data_periodically():
+    # Ciclos en ticks fijos del planificador, sin deriva ni solapamientos
+    await poll_scheduler.run(poll_cycle)
+
+@app.get("/ready", description="Indica si terminó el calentamiento en segundo plano")
+async def get_ready(response: Response):
+    if not warm_up_status["ready"]:
+        response.status_code = 503
+    return warm_up_status
+
+@app.get("/metrics", description="Métricas internas de escritura y conexiones")
+async def get_metrics():
+    return {
+        "write_behind": data_base.writer.metrics(),
+        "log_sink": log_sink.metrics(),
+        "mail": mail.metrics(),
+        "alertas": alertas.metrics(),
+        "leader": leader.metrics(),
+        "poller": poll_scheduler.metrics(),
+        "poll_batch": poll_batch_stats,
+        "cuentas": cuentas.metrics(),
+        "adaptive": poll_policy.metrics(),
+        "recientes": recientes.metrics(),
+        "agregados": agregados.metrics(),
+        "exportar": exportar.metrics(),
+        "last_insert": data_base.last_insert_stats,
+        "read_index": data_base.read_index_available,
+        "db_pool": data_base.pool.stats(),
+    }
+
+warm_up_status["import_seconds"] = time.perf_counter() - _import_started
+print(f"Aplicación importada en {warm_up_status['import_seconds'] * 1000:.1f} ms")
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=9992, reload=True)
@@ -0,0 +1,112 @@
+# Migración de Cuarto_Frio_ArduinoUNOR4 al almacenamiento narrow (ver narrow_storage.py).
+# Crea la dimensión, la tabla de hechos y la vista de compatibilidad, y copia el histórico
+# por propiedad en lotes por value_updated_at. Cada lote se confirma por separado y solo
+# inserta lo que falta, así la migración puede interrumpirse y retomarse sin duplicar.
+# Uso: python migrar_narrow.py [--batch 50000] [--report-only]
+import argparse
+import time
+from datetime import datetime
+import db_pool
+import narrow_storage
+
+dimension_backfill_query = """
+    INSERT INTO dbo.Cuarto_Frio_Propiedades (
+        property_id, created_at, href, linked_to_trigger, name, permission, persist, tag,
+        thing_id, thing_name, type, update_parameter, update_strategy, updated_at, variable_name
+    )
+    SELECT property_id, created_at, href, linked_to_trigger, name, permission, persist, tag,
+           thing_id, thing_name, type, update_parameter, update_strategy, updated_at, variable_name
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY property_id ORDER BY value_updated_at DESC) AS rn
+        FROM dbo.Cuarto_Frio_ArduinoUNOR4
+    ) ultimas
+    WHERE rn = 1
+      AND NOT EXISTS (SELECT 1 FROM dbo.Cuarto_Frio_Propiedades p WHERE p.property_id = ultimas.property_id)
+"""
+
+# Límite superior del siguiente lote de una propiedad (paginación por clave)
+batch_upper_query = """
+    SELECT MAX(value_updated_at) FROM (
+        SELECT TOP (?) value_updated_at
+        FROM dbo.Cuarto_Frio_ArduinoUNOR4
+        WHERE property_id = ? AND value_updated_at > ?
+        ORDER BY value_updated_at
+    ) lote
+"""
+
+# Las filas repetidas de la tabla original (misma propiedad y fecha) se reducen a una
+fact_backfill_query = """
+    INSERT INTO dbo.Cuarto_Frio_Lecturas (property_key, value_updated_at, last_value)
+    SELECT ?, c.value_updated_at, MAX(c.last_value)
+    FROM dbo.Cuarto_Frio_ArduinoUNOR4 c
+    WHERE c.property_id = ? AND c.value_updated_at > ? AND c.value_updated_at <= ?
+      AND c.last_value IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM dbo.Cuarto_Frio_Lecturas l
+                      WHERE l.property_key = ? AND l.value_updated_at = c.value_updated_at)
+    GROUP BY c.value_updated_at
+"""
+
+def backfill(conn, batch):
+    cursor = conn.cursor()
+    added = cursor.execute(dimension_backfill_query).rowcount
+    conn.commit()
+    print(f"Dimensión: {added} propiedades nuevas")
+
+    properties = cursor.execute(
+        "SELECT property_key, property_id FROM dbo.Cuarto_Frio_Propiedades ORDER BY property_key").fetchall()
+    total = 0
+    start = time.perf_counter()
+    for property_key, property_id in properties:
+        lower = datetime(1900, 1, 1)
+        copied = 0
+        while True:
+            upper = cursor.execute(batch_upper_query, batch, property_id, lower).fetchone()[0]
+            if upper is None:
+                break
+            copied += cursor.execute(fact_backfill_query, property_key, property_id, lower, upper,
+                                     property_key).rowcount
+            conn.commit()
+            lower = upper
+        total += copied
+        elapsed = time.perf_counter() - start
+        print(f"{property_id}: {copied} muestras copiadas (total {total}, {total / elapsed if elapsed else 0:.0f} filas/s)")
+
+    skipped = cursor.execute(
+        "SELECT COUNT(*) FROM dbo.Cuarto_Frio_ArduinoUNOR4 WHERE value_updated_at IS NULL").fetchone()[0]
+    if skipped:
+        print(f"{skipped} filas sin value_updated_at no se migraron")
+
+def report(conn):
+    # Tamaño por muestra de la tabla original frente a la narrow
+    cursor = conn.cursor()
+    for table in ("Cuarto_Frio_ArduinoUNOR4", "Cuarto_Frio_Lecturas", "Cuarto_Frio_Propiedades"):
+        rows, reserved_kb = cursor.execute("""
+            SELECT SUM(CASE WHEN ps.index_id IN (0, 1) THEN ps.row_count ELSE 0 END),
+                   SUM(ps.reserved_page_count) * 8
+            FROM sys.dm_db_partition_stats ps
+            WHERE ps.object_id = OBJECT_ID(?)
+        """, f"dbo.{table}").fetchone()
+        rows = rows or 0
+        reserved_kb = reserved_kb or 0
+        per_row = reserved_kb * 1024 / rows if rows else 0
+        print(f"{table}: {rows} filas, {reserved_kb} KB reservados, {per_row:.1f} bytes por fila")
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra Cuarto_Frio_ArduinoUNOR4 al almacenamiento narrow")
+    parser.add_argument("--batch", type=int, default=50000, help="muestras por lote y propiedad")
+    parser.add_argument("--report-only", action="store_true", help="solo muestra el tamaño de las tablas")
+    args = parser.parse_args()
+
+    conn = db_pool.connect()
+    # La copia de un lote grande puede superar el timeout normal de consulta
+    conn.timeout = 0
+    try:
+        if not args.report_only:
+            narrow_storage.create_schema(conn)
+            backfill(conn, args.batch)
+        report(conn)
+    finally:
+        db_pool.close_quietly(conn)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import time
+import pyodbc
+
+# Almacenamiento "narrow": los metadatos de cada propiedad (href, name, permission, tag,
+# thing_name, type, update_*...) viven en la dimensión Cuarto_Frio_Propiedades y solo se
+# actualizan cuando cambian; cada muestra se guarda como (property_key, value_updated_at,
+# last_value) en Cuarto_Frio_Lecturas, con índice agrupado por propiedad y fecha.
+# La vista vw_Cuarto_Frio_ArduinoUNOR4 reconstruye las 17 columnas de la tabla original.
+
+# Posiciones dentro de la fila de data_base.insert_query
+PROPERTY_ID = 2
+LAST_VALUE = 3
+UPDATED_AT = 14
+VALUE_UPDATED_AT = 15
+METADATA_COLUMNS = (0, 1, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 16)
+
+schema_queries = (
+    """
+    IF OBJECT_ID('dbo.Cuarto_Frio_Propiedades') IS NULL
+    CREATE TABLE dbo.Cuarto_Frio_Propiedades (
+        property_key INT IDENTITY(1, 1) NOT NULL CONSTRAINT PK_Cuarto_Frio_Propiedades PRIMARY KEY,
+        property_id NVARCHAR(64) NOT NULL CONSTRAINT UX_Cuarto_Frio_Propiedades_property_id UNIQUE,
+        created_at DATETIME2(3) NULL,
+        href NVARCHAR(512) NULL,
+        linked_to_trigger BIT NULL,
+        name NVARCHAR(255) NULL,
+        permission NVARCHAR(32) NULL,
+        persist BIT NULL,
+        tag INT NULL,
+        thing_id NVARCHAR(64) NULL,
+        thing_name NVARCHAR(255) NULL,
+        type NVARCHAR(64) NULL,
+        update_parameter FLOAT NULL,
+        update_strategy NVARCHAR(32) NULL,
+        updated_at DATETIME2(3) NULL,
+        variable_name NVARCHAR(255) NULL
+    )
+    """,
+    """
+    IF OBJECT_ID('dbo.Cuarto_Frio_Lecturas') IS NULL
+    CREATE TABLE dbo.Cuarto_Frio_Lecturas (
+        property_key INT NOT NULL,
+        value_updated_at DATETIME2(3) NOT NULL,
+        last_value FLOAT NOT NULL,
+        CONSTRAINT PK_Cuarto_Frio_Lecturas PRIMARY KEY CLUSTERED (property_key, value_updated_at)
+            WITH (DATA_COMPRESSION = PAGE)
+    )
+    """,
+    """
+    CREATE OR ALTER VIEW dbo.vw_Cuarto_Frio_ArduinoUNOR4 AS
+    SELECT p.created_at, p.href, p.property_id, l.last_value, p.linked_to_trigger,
+           p.name, p.permission, p.persist, p.tag, p.thing_id, p.thing_name,
+           p.type, p.update_parameter, p.update_strategy, p.updated_at, l.value_updated_at, p.variable_name
+    FROM dbo.Cuarto_Frio_Lecturas l
+    JOIN dbo.Cuarto_Frio_Propiedades p ON p.property_key = l.property_key
+    """,
+)
+
+# La API no crea el esquema (requiere ALTER en cada arranque); solo comprueba que
+# migrar_narrow.py ya lo haya creado
+schema_check_query = """
+    SELECT OBJECT_ID('dbo.Cuarto_Frio_Propiedades'), OBJECT_ID('dbo.Cuarto_Frio_Lecturas'),
+           OBJECT_ID('dbo.vw_Cuarto_Frio_ArduinoUNOR4')
+"""
+
+dimension_upsert_query = """
+    MERGE dbo.Cuarto_Frio_Propiedades WITH (HOLDLOCK) AS destino
+    USING (VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)) AS origen (
+        property_id, created_at, href, linked_to_trigger, name, permission, persist, tag,
+        thing_id, thing_name, type, update_parameter, update_strategy, updated_at, variable_name
+    )
+    ON destino.property_id = origen.property_id
+    WHEN MATCHED THEN
+        UPDATE SET created_at = origen.created_at, href = origen.href,
+                   linked_to_trigger = origen.linked_to_trigger, name = origen.name,
+                   permission = origen.permission, persist = origen.persist, tag = origen.tag,
+                   thing_id = origen.thing_id, thing_name = origen.thing_name, type = origen.type,
+                   update_parameter = origen.update_parameter, update_strategy = origen.update_strategy,
+                   updated_at = origen.updated_at, variable_name = origen.variable_name
+    WHEN NOT MATCHED THEN
+        INSERT (property_id, created_at, href, linked_to_trigger, name, permission, persist, tag,
+                thing_id, thing_name, type, update_parameter, update_strategy, updated_at, variable_name)
+        VALUES (origen.property_id, origen.created_at, origen.href, origen.linked_to_trigger, origen.name,
+                origen.permission, origen.persist, origen.tag, origen.thing_id, origen.thing_name, origen.type,
+                origen.update_parameter, origen.update_strategy, origen.updated_at, origen.variable_name)
+    OUTPUT inserted.property_key;
+"""
+
+# La clave primaria hace que repetir un lote (reintento o spool) no duplique muestras
+fact_upsert_query = """
+    MERGE dbo.Cuarto_Frio_Lecturas AS destino
+    USING (VALUES (?, ?, ?)) AS origen (property_key, value_updated_at, last_value)
+    ON destino.property_key = origen.property_key AND destino.value_updated_at = origen.value_updated_at
+    WHEN MATCHED AND destino.last_value <> origen.last_value THEN
+        UPDATE SET last_value = origen.last_value
+    WHEN NOT MATCHED THEN
+        INSERT (property_key, value_updated_at, last_value)
+        VALUES (origen.property_key, origen.value_updated_at, origen.last_value);
+"""
+
+latest_samples_query = """
+    SELECT p.property_id, l.value_updated_at, l.last_value
+    FROM dbo.Cuarto_Frio_Propiedades p
+    CROSS APPLY (
+        SELECT TOP (1) value_updated_at, last_value
+        FROM dbo.Cuarto_Frio_Lecturas
+        WHERE property_key = p.property_key
+        ORDER BY value_updated_at DESC
+    ) l
+"""
+
+# property_id -> (property_key, metadatos guardados)
+_dimension = {}
+
+def metadata_of(row):
+    return tuple(row[i] for i in METADATA_COLUMNS)
+
+def create_schema(conn):
+    cursor = conn.cursor()
+    for query in schema_queries:
+        cursor.execute(query)
+    conn.commit()
+
+def schema_exists(conn):
+    return None not in conn.cursor().execute(schema_check_query).fetchone()
+
+def load_dimension(conn):
+    _dimension.clear()
+    rows = conn.cursor().execute("""
+        SELECT property_key, property_id, created_at, href, linked_to_trigger, name, permission, persist,
+               tag, thing_id, thing_name, type, update_parameter, update_strategy, updated_at, variable_name
+        FROM dbo.Cuarto_Frio_Propiedades
+    """).fetchall()
+    for row in rows:
+        _dimension[row[1]] = (row[0], tuple(row[2:]))
+
+def property_keys(conn, rows):
+    # Solo se escribe en la dimensión cuando la propiedad es nueva o cambió algún metadato
+    if not _dimension:
+        load_dimension(conn)
+    cursor = conn.cursor()
+    keys = {}
+    for row in rows:
+        property_id = row[PROPERTY_ID]
+        if property_id in keys:
+            continue
+        metadata = metadata_of(row)
+        known = _dimension.get(property_id)
+        if known is not None and known[1] == metadata:
+            keys[property_id] = known[0]
+            continue
+        property_key = cursor.execute(dimension_upsert_query, property_id, *metadata).fetchone()[0]
+        _dimension[property_id] = (property_key, metadata)
+        keys[property_id] = property_key
+    return keys
+
+def write(conn, rows):
+    # Devuelve el número de muestras escritas; las que no tienen value_updated_at se descartan
+    start = time.perf_counter()
+    keys = property_keys(conn, rows)
+    samples = [(keys[row[PROPERTY_ID]], row[VALUE_UPDATED_AT], row[LAST_VALUE])
+               for row in rows if row[VALUE_UPDATED_AT] is not None]
+    if len(samples) < len(rows):
+        print(f"{len(rows) - len(samples)} muestras sin value_updated_at no se guardaron")
+    if samples:
+        cursor = conn.cursor()
+        try:
+            cursor.fast_executemany = True
+            cursor.executemany(fact_upsert_query, samples)
+        except pyodbc.Error as e:
+            if isinstance(e, (pyodbc.OperationalError, pyodbc.InterfaceError)):
+                raise
+            print(f"fast_executemany no disponible, se escribe fila por fila: {e}")
+            cursor.fast_executemany = False
+            cursor.executemany(fact_upsert_query, samples)
+        finally:
+            cursor.close()
+    return len(samples), time.perf_counter() - start
+
+def reset_cache():
+    _dimension.clear()
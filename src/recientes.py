@@ -0,0 +1,131 @@
+import os
+import time
+from array import array
+from datetime import timezone
+from dotenv import load_dotenv
+from fechas import parse_datetime
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Lecturas recientes en memoria: por cada property_id un búfer circular con dos arreglos
+# paralelos (fecha en segundos epoch y valor) que cubre las últimas RECENT_WINDOW horas.
+# /recent responde desde aquí con búsqueda binaria, sin consultar SQL Server ni la nube
+RECENT_WINDOW = float(os.getenv("RECENT_WINDOW", 24)) * 3600
+# Máximo de muestras por propiedad; por defecto alcanza para la ventana a una lectura cada
+# 10 s. Los arreglos crecen a medida que llegan muestras, sin reservar la capacidad completa
+RECENT_INITIAL = 64
+RECENT_CAPACITY = int(os.getenv("RECENT_CAPACITY", RECENT_WINDOW // 10))
+
+class RingBuffer:
+    def __init__(self, capacity=RECENT_CAPACITY, window=RECENT_WINDOW):
+        self.capacity = capacity
+        self.window = window
+        self.timestamps = array("d")
+        self.values = array("d")
+        self.start = 0
+        self.count = 0
+
+    def _at(self, index):
+        return (self.start + index) % len(self.timestamps)
+
+    def _grow(self):
+        # Duplica el espacio hasta capacity, dejando las muestras en orden desde la posición 0
+        size = min(self.capacity, max(RECENT_INITIAL, 2 * len(self.timestamps)))
+        positions = [self._at(index) for index in range(self.count)]
+        padding = bytes(8 * (size - self.count))
+        self.timestamps = array("d", [self.timestamps[i] for i in positions])
+        self.timestamps.frombytes(padding)
+        self.values = array("d", [self.values[i] for i in positions])
+        self.values.frombytes(padding)
+        self.start = 0
+
+    def append(self, timestamp, value):
+        # Las fechas llegan en orden; una lectura repetida o anterior a la última se ignora
+        if self.count and timestamp <= self.timestamps[self._at(self.count - 1)]:
+            return False
+        if self.count == len(self.timestamps) and self.count < self.capacity:
+            self._grow()
+        if self.count == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+        position = self._at(self.count)
+        self.timestamps[position] = timestamp
+        self.values[position] = value
+        self.count += 1
+        self.expire(timestamp - self.window)
+        return True
+
+    def expire(self, oldest):
+        drop = self.bisect_left(oldest)
+        self.start = self._at(drop)
+        self.count -= drop
+
+    def bisect_left(self, timestamp):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._at(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, since, until):
+        # Muestras con since <= fecha < until, en orden cronológico
+        first = self.bisect_left(since)
+        last = self.bisect_left(until)
+        positions = [self._at(index) for index in range(first, last)]
+        return [self.timestamps[i] for i in positions], [self.values[i] for i in positions]
+
+    def last(self):
+        if not self.count:
+            return None
+        position = self._at(self.count - 1)
+        return self.timestamps[position], self.values[position]
+
+buffers = {}
+# thing_id -> property_ids, para consultar un thing completo
+thing_properties = {}
+
+def to_epoch(value):
+    # Fechas de Arduino Cloud: naive en UTC
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+def add_properties(properties):
+    # Alimentado por el poller con la respuesta de Arduino Cloud de un thing
+    added = 0
+    for item in properties:
+        property_id = item.get("id")
+        updated_at = parse_datetime(item.get("value_updated_at"))
+        try:
+            value = float(item.get("last_value"))
+        except (TypeError, ValueError):
+            continue
+        if property_id is None or updated_at is None:
+            continue
+        buffer = buffers.get(property_id)
+        if buffer is None:
+            buffer = buffers[property_id] = RingBuffer()
+        added += buffer.append(to_epoch(updated_at), value)
+        thing_properties.setdefault(item.get("thing_id"), set()).add(property_id)
+    return added
+
+def query(property_ids, since, until=None):
+    until = time.time() + 1 if until is None else until
+    result = {}
+    for property_id in property_ids:
+        buffer = buffers.get(property_id)
+        if buffer is not None:
+            result[property_id] = buffer.range(since, until)
+    return result
+
+def metrics():
+    samples = sum(buffer.count for buffer in buffers.values())
+    return {
+        "properties": len(buffers),
+        "samples": samples,
+        "capacity_per_property": RECENT_CAPACITY,
+        "window_hours": RECENT_WINDOW / 3600,
+        "bytes": sum(len(buffer.timestamps) * 16 for buffer in buffers.values()),
+    }
@@ -0,0 +1,72 @@
+# Reconstrucción de Cuarto_Frio_Agregados desde las lecturas (ver agregados.py), para
+# cargas históricas, migraciones o después de activar ROLLUPS. Recalcula día por día y
+# propiedad por propiedad; cada día se confirma por separado, así puede repetirse o
+# interrumpirse sin dejar intervalos a medias. También crea el índice de lectura que
+# ROLLUPS=1 necesita para recalcular cada lote sin recorrer la tabla completa.
+# Uso: python reconstruir_agregados.py [--property ID] [--from 2024-01-01] [--to 2024-02-01]
+import argparse
+import time
+from datetime import timedelta
+import agregados
+import data_base
+import db_pool
+from fechas import parse_datetime
+
+def property_ranges(conn, property_id=None):
+    # property_id -> (primera, última) lectura
+    source = agregados.source_table(data_base.STORAGE_MODE)
+    query = f"SELECT property_id, MIN(value_updated_at), MAX(value_updated_at) FROM {source}"
+    if property_id:
+        return conn.cursor().execute(query + " WHERE property_id = ? GROUP BY property_id", property_id).fetchall()
+    return conn.cursor().execute(query + " GROUP BY property_id").fetchall()
+
+def parse_day(value):
+    if value is None:
+        return None
+    parsed = parse_datetime(value if "T" in value else value + "T00:00:00")
+    if parsed is None:
+        raise SystemExit(f"Fecha no válida: {value}")
+    return parsed
+
+def rebuild(conn, property_id, first, last):
+    day = agregados.floor_to(first, 86400)
+    days = 0
+    while day <= last:
+        following = day + timedelta(days=1)
+        agregados.refresh(conn, property_id, day, following, data_base.STORAGE_MODE)
+        conn.commit()
+        day = following
+        days += 1
+    return days
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye los agregados por minuto, hora y día")
+    parser.add_argument("--property", help="solo esta propiedad")
+    parser.add_argument("--from", dest="start", help="primer día (UTC), por defecto la primera lectura")
+    parser.add_argument("--to", dest="end", help="último día (UTC, exclusivo), por defecto la última lectura")
+    args = parser.parse_args()
+    start, end = parse_day(args.start), parse_day(args.end)
+
+    conn = db_pool.connect()
+    # Un día de una propiedad con mucha frecuencia puede superar el timeout normal
+    conn.timeout = 0
+    try:
+        if data_base.STORAGE_MODE != "narrow":
+            data_base.create_read_index(conn)
+        agregados.create_schema(conn)
+        ranges = property_ranges(conn, args.property)
+        started = time.perf_counter()
+        for property_id, first, last in ranges:
+            if first is None:
+                continue
+            first = max(first, start) if start else first
+            last = min(last, end - timedelta(milliseconds=1)) if end else last
+            if first > last:
+                continue
+            days = rebuild(conn, property_id, first, last)
+            print(f"{property_id}: {days} días recalculados ({time.perf_counter() - started:.1f}s)")
+    finally:
+        db_pool.close_quietly(conn)
+
+if __name__ == "__main__":
+    main()
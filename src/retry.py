@@ -0,0 +1,76 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Reintentos con espera exponencial y jitter dentro de un presupuesto total de tiempo.
+# Solo se reintentan los errores transitorios: timeouts, errores de conexión, 5xx y 429
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 8))
+DATA_DEADLINE = float(os.getenv("DATA_DEADLINE", 20))
+POLL_DEADLINE = float(os.getenv("POLL_DEADLINE", 45))
+
+class FetchError(RuntimeError):
+    def __init__(self, message, status_code=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+def parse_retry_after(value):
+    # Retry-After admite segundos o una fecha HTTP
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def from_http_error(error, message):
+    response = error.response
+    status = response.status_code if response is not None else None
+    retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+    retryable = status is not None and (status == 429 or status >= 500)
+    return FetchError(message, status_code=status, retryable=retryable, retry_after=retry_after)
+
+def is_retryable(error):
+    if isinstance(error, FetchError):
+        return error.retryable
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError, requests.exceptions.Timeout,
+                              requests.exceptions.ConnectionError))
+
+def backoff_delay(attempt, error=None):
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    # Full jitter: espera aleatoria entre 0 y el tope exponencial
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+async def call_with_retry(factory, deadline, attempts=RETRY_ATTEMPTS, name="petición"):
+    # factory() crea la corrutina de cada intento; ningún intento ni espera supera el plazo
+    expires = time.monotonic() + deadline
+    for attempt in range(attempts):
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Se agotó el plazo de {deadline}s para {name}")
+        try:
+            return await asyncio.wait_for(factory(), remaining)
+        except Exception as e:
+            if attempt + 1 >= attempts or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            if time.monotonic() + delay >= expires:
+                raise
+            print(f"Intento {attempt + 1} de {name} fallido: {e}. Reintentando en {delay:.1f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,93 @@
+import asyncio
+import math
+import os
+import random
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Planificador de periodo fijo: los ciclos se disparan en múltiplos exactos del periodo
+# según el reloj de pared, así la duración de un ciclo no desplaza a los siguientes.
+# POLL_OVERLAP indica qué hacer si un tick llega con el ciclo anterior aún en curso:
+# "skip" lo descarta, "coalesce" ejecuta un único ciclo extra al terminar el actual
+POLL_PERIOD = float(os.getenv("POLL_PERIOD", 60))
+POLL_JITTER = float(os.getenv("POLL_JITTER", 0))
+POLL_OVERLAP = os.getenv("POLL_OVERLAP", "skip")
+
+class FixedRateScheduler:
+    def __init__(self, name, period=POLL_PERIOD, jitter=POLL_JITTER, overlap=POLL_OVERLAP):
+        self.name = name
+        self.period = period
+        self.jitter = jitter
+        self.overlap = overlap
+        self._current = None
+        self._pending_tick = None
+        self._stats = {
+            "cycles": 0,
+            "skipped": 0,
+            "coalesced": 0,
+            "failed": 0,
+            "last_lateness": None,
+            "max_lateness": 0.0,
+            "last_duration": None,
+            "max_duration": 0.0,
+            "avg_duration": None,
+        }
+
+    def next_tick(self, now):
+        return math.floor(now / self.period + 1) * self.period
+
+    async def run(self, cycle):
+        try:
+            tick = self.next_tick(time.time())
+            while True:
+                # El jitter se suma al tick sin acumularse en los siguientes
+                delay = tick + random.uniform(0, self.jitter) - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._on_tick(cycle, tick)
+                tick = self.next_tick(max(time.time(), tick))
+        finally:
+            if self._current is not None:
+                self._current.cancel()
+
+    def _on_tick(self, cycle, tick):
+        if self._current is not None and not self._current.done():
+            if self.overlap == "coalesce":
+                if self._pending_tick is None:
+                    self._pending_tick = tick
+                else:
+                    self._stats["coalesced"] += 1
+            else:
+                self._stats["skipped"] += 1
+                print(f"{self.name}: ciclo anterior en curso, se omite el tick de las {time.strftime('%H:%M:%S', time.localtime(tick))}")
+            return
+        self._start(cycle, tick)
+
+    def _start(self, cycle, tick):
+        lateness = time.time() - tick
+        self._stats["last_lateness"] = lateness
+        self._stats["max_lateness"] = max(self._stats["max_lateness"], lateness)
+        started = time.monotonic()
+        self._current = asyncio.create_task(cycle())
+        self._current.add_done_callback(lambda task: self._finished(cycle, task, started))
+
+    def _finished(self, cycle, task, started):
+        duration = time.monotonic() - started
+        self._stats["cycles"] += 1
+        self._stats["last_duration"] = duration
+        self._stats["max_duration"] = max(self._stats["max_duration"], duration)
+        avg = self._stats["avg_duration"]
+        self._stats["avg_duration"] = duration if avg is None else avg * 0.9 + duration * 0.1
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["failed"] += 1
+            print(f"{self.name}: el ciclo terminó con error: {task.exception()}")
+        if self._pending_tick is not None and not task.cancelled():
+            tick, self._pending_tick = self._pending_tick, None
+            self._start(cycle, tick)
+
+    def metrics(self):
+        return dict(self._stats, period=self.period, overlap=self.overlap,
+                    running=self._current is not None and not self._current.done())
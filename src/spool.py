@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Spool local de lecturas: archivo NDJSON de solo anexado que recibe las escrituras
+# mientras SQL Server no está disponible y se reproduce en bloque al volver la conexión.
+# El offset de reproducción se guarda en un archivo aparte para retomar tras una caída.
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", 5000))
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", 15))
+
+class Spool:
+    def __init__(self, name, directory=SPOOL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.ndjson")
+        self.offset_path = os.path.join(directory, f"{name}.offset")
+        # Líneas que no se pudieron decodificar; se apartan para no bloquear la reproducción
+        self.quarantine_path = os.path.join(directory, f"{name}.quarantine")
+        self.quarantined = 0
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._replayer = None
+        self._repair()
+
+    def _repair(self):
+        # Una caída a mitad de escritura puede dejar una última línea incompleta
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(max(size - 65536, 0))
+            tail = f.read()
+            if tail.endswith(b"\n"):
+                return
+            last_newline = tail.rfind(b"\n")
+            keep = size - len(tail) + last_newline + 1 if last_newline >= 0 else 0
+            print(f"Spool {self.path}: se descarta una línea incompleta de {size - keep} bytes")
+            f.truncate(keep)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, records):
+        # Un solo write y un solo fsync por lote
+        data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(data.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, "r") as f:
+                offset = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            print(f"Spool {self.path}: offset no válido, se reproduce desde el inicio")
+            return 0
+        # Un offset mayor que el archivo es de antes de una compactación: se reproduce todo
+        # (la escritura es idempotente) en lugar de buscar en medio de una línea
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return offset if offset <= size else 0
+
+    def _quarantine(self, line, error):
+        with open(self.quarantine_path, "ab") as f:
+            f.write(line if line.endswith(b"\n") else line + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.quarantined += 1
+        print(f"Spool {self.path}: línea no válida movida a {self.quarantine_path}: {error}")
+
+    def _write_offset(self, offset):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def pending(self):
+        with self._lock:
+            if not os.path.exists(self.path):
+                return False
+            return os.path.getsize(self.path) > self._read_offset()
+
+    def replay(self, write_function, batch_size=SPOOL_REPLAY_BATCH):
+        # write_function debe ser idempotente: si el proceso cae entre el commit y el
+        # guardado del offset, el último lote se reproduce otra vez
+        replayed = 0
+        with self._replay_lock:
+            offset = self._read_offset()
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                while True:
+                    records = []
+                    end = offset
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break
+                        end += len(line)
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError as e:
+                            self._quarantine(line, e)
+                            continue
+                        if len(records) >= batch_size:
+                            break
+                    if end == offset:
+                        break
+                    if records:
+                        write_function(records)
+                    offset = end
+                    self._write_offset(offset)
+                    replayed += len(records)
+                    f.seek(offset)
+            self._compact(offset)
+        return replayed
+
+    def _compact(self, offset):
+        # Si ya se reprodujo todo se vacía el archivo para que no crezca sin límite
+        with self._lock:
+            if os.path.getsize(self.path) == offset:
+                # Primero el offset: si el proceso cae antes de vaciar el archivo, el
+                # contenido se reproduce de nuevo, lo que es inofensivo con MERGE
+                self._write_offset(0)
+                with open(self.path, "wb") as f:
+                    os.fsync(f.fileno())
+
+    def start_replayer(self, write_function, interval=SPOOL_REPLAY_INTERVAL):
+        if self._replayer is None or not self._replayer.is_alive():
+            self._replayer = threading.Thread(target=self._replay_loop, args=(write_function, interval),
+                                              name="spool-replayer", daemon=True)
+            self._replayer.start()
+
+    def _replay_loop(self, write_function, interval):
+        while True:
+            time.sleep(interval)
+            if not self.pending():
+                continue
+            start = time.perf_counter()
+            try:
+                replayed = self.replay(write_function)
+            except Exception as e:
+                print(f"No se pudo reproducir el spool {self.path}, se reintentará: {e}")
+                continue
+            seconds = time.perf_counter() - start
+            print(f"Spool {self.path}: {replayed} registros reproducidos en {seconds:.2f}s")
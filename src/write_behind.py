@@ -0,0 +1,122 @@
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Las lecturas se acumulan en memoria y se escriben en grupo cuando hay
+# WRITE_BATCH_ROWS filas o pasan WRITE_FLUSH_MS milisegundos, lo que ocurra primero
+WRITE_BATCH_ROWS = int(os.getenv("WRITE_BATCH_ROWS", 500))
+WRITE_FLUSH_MS = int(os.getenv("WRITE_FLUSH_MS", 1000))
+WRITE_QUEUE_MAX = int(os.getenv("WRITE_QUEUE_MAX", 20000))
+WRITE_PUT_TIMEOUT = float(os.getenv("WRITE_PUT_TIMEOUT", 30))
+
+class WriteBehindBuffer:
+    def __init__(self, flush_function, batch_rows=WRITE_BATCH_ROWS, flush_ms=WRITE_FLUSH_MS,
+                 max_rows=WRITE_QUEUE_MAX, name="write-behind"):
+        self.flush_function = flush_function
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_ms / 1000
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_rows)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "failed": 0,
+            "flushes": 0,
+            "blocked_puts": 0,
+            "dropped": 0,
+            "rejected": 0,
+            "last_batch_rows": 0,
+            "last_flush_seconds": 0.0,
+            "max_depth": 0,
+        }
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def put_many(self, rows, timeout=WRITE_PUT_TIMEOUT):
+        # Si la cola está llena el productor espera (contrapresión) hasta timeout.
+        # Devuelve cuántas filas se encolaron; las restantes quedan a cargo de quien llama
+        self.start()
+        queued = 0
+        try:
+            for row in rows:
+                try:
+                    self._queue.put_nowait(row)
+                except queue.Full:
+                    self._stats["blocked_puts"] += 1
+                    self._queue.put(row, timeout=timeout)
+                queued += 1
+        except queue.Full:
+            self._stats["rejected"] += len(rows) - queued
+        self._stats["enqueued"] += queued
+        self._stats["max_depth"] = max(self._stats["max_depth"], self._queue.qsize())
+        return queued
+
+    def offer(self, row):
+        # Variante que nunca bloquea: si la cola está llena la fila se descarta
+        self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._stats["dropped"] += 1
+            return False
+        self._stats["enqueued"] += 1
+        return True
+
+    def fill_ratio(self):
+        return self._queue.qsize() / self._queue.maxsize
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            self.flush_function(batch)
+            self._stats["written"] += len(batch)
+        except Exception as e:
+            self._stats["failed"] += len(batch)
+            print(f"Error al escribir un lote de {len(batch)} lecturas: {e}")
+        self._stats["flushes"] += 1
+        self._stats["last_batch_rows"] = len(batch)
+        self._stats["last_flush_seconds"] = time.perf_counter() - start
+
+    def stop(self, timeout=30):
+        # Vacía lo pendiente antes de terminar
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        return dict(self._stats, depth=self._queue.qsize(), capacity=self._queue.maxsize)